@@ -4,241 +4,285 @@ Produces the final build output: main.py, requirements.txt, .env.example,
 and copies compiled agent files to the build directory.
 """
 
+import functools
+import io
+
 from .codegen import PROVIDER_MAP
 from .validator import AgentAST, ProjectAST
 
 
+_MAIN_IMPORTS = """\
+import logging
+import os
+import uuid
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field
+from pydantic_settings import BaseSettings
+from typing import Any, Literal, Optional
+
+"""
+
+_SETTINGS_FOOTER = """
+    class Config:
+        env_file = '.env'
+
+
+settings = Settings()
+
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+
+"""
+
+_CORS_MIDDLEWARE = """\
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[{origins}],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+"""
+
+_AUTH_DEPENDENCY = """\
+# --- Authentication ---
+API_KEY = os.getenv("{auth_env}", "")
+
+
+async def verify_api_key(request: Request):
+    api_key = request.headers.get("X-API-Key")
+    if not api_key or api_key != API_KEY:
+        raise HTTPException(status_code=403, detail="Invalid or missing API key")
+
+
+"""
+
+_DOCS_REQUIRE_AUTH = """\
+# Documentation requires auth
+app.docs_url = "/docs"
+app.redoc_url = "/redoc"
+
+
+"""
+
+_HEALTH_ENDPOINT = """\
+# --- Health Check ---
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+"""
+
+_UVICORN_RUNNER = """\
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="{host}", port={port})
+"""
+
+
+_ENDPOINT_HEAD = '''\
+@app.post("/run/{name}"{deps})
+async def run_{name}(request: {pascal}Request):
+    """{desc}"""
+    request_id = str(uuid.uuid4())[:12]
+    try:
+        input_state = request.model_dump()
+        input_state["messages"] = []
+        result = {name}_graph.invoke(input_state)
+
+        # Serialize messages
+        serialized_messages = []
+        for msg in result.get("messages", []):
+            if hasattr(msg, 'type'):
+                role = msg.type
+                if role == "human":
+                    role = "human"
+                elif role == "ai":
+                    role = "assistant"
+                serialized_messages.append({{"role": role, "content": msg.content}})
+            elif isinstance(msg, dict):
+                serialized_messages.append(msg)
+
+        # Build response (only exposed fields)
+        response_data = {{}}
+'''
+
+_ENDPOINT_TAIL = """\
+        response_data["messages"] = serialized_messages
+
+        return response_data
+
+    except Exception as e:
+        logger.exception(f"Agent {name} failed: {{e}}")
+        error_detail = {{"detail": "Agent execution failed", "error_code": "R500", "agent": "{name}", "request_id": f"req_{{request_id}}"}}
+        if os.getenv("LOG_LEVEL", "INFO") == "DEBUG":
+            error_detail["error"] = str(e)
+        raise HTTPException(status_code=500, detail=error_detail)
+"""
+
+
 def generate_main_py(project: ProjectAST, agents: dict[str, AgentAST]) -> str:
     """Generate the main.py FastAPI server file."""
-    lines: list[str] = []
+    buf = io.StringIO()
+    w = buf.write
+    sorted_agents = [(name, _to_pascal(name), agent) for name, agent in sorted(agents.items())]
 
-    # Imports
-    lines.append("import logging")
-    lines.append("import os")
-    lines.append("import uuid")
-    lines.append("")
-    lines.append("from fastapi import Depends, FastAPI, HTTPException, Request")
-    lines.append("from fastapi.middleware.cors import CORSMiddleware")
-    lines.append("from pydantic import BaseModel, Field")
-    lines.append("from pydantic_settings import BaseSettings")
-    lines.append("from typing import Any, Literal, Optional")
-    lines.append("")
+    w(_MAIN_IMPORTS)
 
     # Import compiled agents
-    for name in sorted(agents.keys()):
-        lines.append(f"from compiled_{name} import AgentState as {_to_pascal(name)}State")
-        lines.append(f"from compiled_{name} import graph as {name}_graph")
-    lines.append("")
-    lines.append("")
+    for name, pascal, _ in sorted_agents:
+        w(f"from compiled_{name} import AgentState as {pascal}State\n")
+        w(f"from compiled_{name} import graph as {name}_graph\n")
+    w("\n\n")
 
     # Settings class
-    lines.append("# --- Environment Settings ---")
-    lines.append("class Settings(BaseSettings):")
+    w("# --- Environment Settings ---\n")
+    w("class Settings(BaseSettings):\n")
     if project.env_vars:
         for var in project.env_vars:
             if var["required"] and var.get("default") is None:
-                lines.append(f'    {var["name"]}: str')
+                w(f'    {var["name"]}: str\n')
             elif var.get("default") is not None:
-                lines.append(f'    {var["name"]}: str = "{var["default"]}"')
+                w(f'    {var["name"]}: str = "{var["default"]}"\n')
             else:
-                lines.append(f'    {var["name"]}: str = ""')
+                w(f'    {var["name"]}: str = ""\n')
     else:
-        lines.append("    pass")
-    lines.append("")
-    lines.append("    class Config:")
-    lines.append("        env_file = '.env'")
-    lines.append("")
-    lines.append("")
-    lines.append("settings = Settings()")
-    lines.append("")
-    lines.append("")
-
-    # Logger
-    lines.append('logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))')
-    lines.append("logger = logging.getLogger(__name__)")
-    lines.append("")
-    lines.append("")
+        w("    pass\n")
+    w(_SETTINGS_FOOTER)
 
     # FastAPI app
-    lines.append(f'app = FastAPI(title="{project.name}")')
-    lines.append("")
+    w(f'app = FastAPI(title="{project.name}")\n\n')
 
     # CORS
     origins = [o.strip() for o in project.cors_origins.split(",")]
     origins_str = ", ".join(f'"{o}"' for o in origins)
-    lines.append("app.add_middleware(")
-    lines.append("    CORSMiddleware,")
-    lines.append(f"    allow_origins=[{origins_str}],")
-    lines.append('    allow_credentials=True,')
-    lines.append('    allow_methods=["*"],')
-    lines.append('    allow_headers=["*"],')
-    lines.append(")")
-    lines.append("")
-    lines.append("")
+    w(_CORS_MIDDLEWARE.format(origins=origins_str))
 
     # Auth dependency
     if project.auth_env:
-        lines.append("# --- Authentication ---")
-        lines.append(f'API_KEY = os.getenv("{project.auth_env}", "")')
-        lines.append("")
-        lines.append("")
-        lines.append("async def verify_api_key(request: Request):")
-        lines.append('    api_key = request.headers.get("X-API-Key")')
-        lines.append("    if not api_key or api_key != API_KEY:")
-        lines.append('        raise HTTPException(status_code=403, detail="Invalid or missing API key")')
-        lines.append("")
-        lines.append("")
+        w(_AUTH_DEPENDENCY.format(auth_env=project.auth_env))
 
     # Documentation endpoint visibility
     if project.auth_env and not project.docs_public:
-        lines.append("# Documentation requires auth")
-        lines.append('app.docs_url = "/docs"')
-        lines.append('app.redoc_url = "/redoc"')
-        lines.append("")
-        lines.append("")
+        w(_DOCS_REQUIRE_AUTH)
 
-    # Health endpoint
-    lines.append("# --- Health Check ---")
-    lines.append('@app.get("/health")')
-    lines.append("async def health():")
-    lines.append('    return {"status": "ok"}')
-    lines.append("")
-    lines.append("")
+    w(_HEALTH_ENDPOINT)
 
     # Request/Response models and endpoints for each agent
-    for name, agent in sorted(agents.items()):
-        lines.extend(_generate_agent_endpoint(name, agent, project))
-        lines.append("")
-        lines.append("")
+    deps = ", dependencies=[Depends(verify_api_key)]" if project.auth_env else ""
+    for name, pascal, agent in sorted_agents:
+        w(_generate_agent_endpoint(name, agent, pascal, deps))
+        w("\n\n")
 
-    # Uvicorn runner
-    lines.append('if __name__ == "__main__":')
-    lines.append("    import uvicorn")
-    lines.append(f'    uvicorn.run(app, host="{project.host}", port={project.port})')
-    lines.append("")
+    w(_UVICORN_RUNNER.format(host=project.host, port=project.port))
 
-    return "\n".join(lines)
+    return buf.getvalue()
 
 
 def _generate_agent_endpoint(
-    name: str, agent: AgentAST, project: ProjectAST
-) -> list[str]:
-    """Generate request/response models and endpoint for an agent."""
-    lines: list[str] = []
-    pascal = _to_pascal(name)
-
-    # Request model
-    lines.append(f"# --- Agent: {name} ---")
-    lines.append(f"class {pascal}Request(BaseModel):")
-    has_fields = False
+    name: str, agent: AgentAST, pascal: str, deps: str
+) -> str:
+    """Generate request/response models and endpoint for an agent.
+
+    `pascal` is the agent's PascalCase name and `deps` the route's
+    `dependencies=` suffix (empty when auth is disabled).
+    """
+    buf = io.StringIO()
+    w = buf.write
+
+    # Shape the state fields once for the request, response and result blocks
+    request_fields: list[tuple[str, str, str | None]] = []
+    exposed_fields: list[tuple[str, str]] = []
     for field in agent.state_fields:
+        py_type = _get_api_type(field)
         if field["required"]:
-            py_type = _get_api_type(field)
-            lines.append(f'    {field["name"]}: {py_type}')
-            has_fields = True
+            request_fields.append((field["name"], py_type, None))
         elif field["default"] is not None:
-            py_type = _get_api_type(field)
-            default_val = _get_python_default(field)
-            lines.append(f'    {field["name"]}: {py_type} = {default_val}')
-            has_fields = True
-    if not has_fields:
-        lines.append("    pass")
-    lines.append("")
-    lines.append("")
+            request_fields.append((field["name"], py_type, _get_python_default(field)))
+        if field["expose"]:
+            exposed_fields.append((field["name"], py_type))
+
+    # Request model
+    w(f"# --- Agent: {name} ---\n")
+    w(f"class {pascal}Request(BaseModel):\n")
+    for field_name, py_type, default_val in request_fields:
+        if default_val is None:
+            w(f"    {field_name}: {py_type}\n")
+        else:
+            w(f"    {field_name}: {py_type} = {default_val}\n")
+    if not request_fields:
+        w("    pass\n")
+    w("\n\n")
 
     # Response model
-    lines.append(f"class {pascal}Response(BaseModel):")
-    has_response_fields = False
-    for field in agent.state_fields:
-        if field["expose"]:
-            py_type = _get_api_type(field)
-            lines.append(f'    {field["name"]}: Optional[{py_type}] = None')
-            has_response_fields = True
-    lines.append('    messages: list[dict[str, Any]] = []')
-    lines.append("")
-    lines.append("")
+    w(f"class {pascal}Response(BaseModel):\n")
+    for field_name, py_type in exposed_fields:
+        w(f"    {field_name}: Optional[{py_type}] = None\n")
+    w('    messages: list[dict[str, Any]] = []\n')
+    w("\n\n")
 
     # Endpoint
-    deps = ""
-    if project.auth_env:
-        deps = ", dependencies=[Depends(verify_api_key)]"
-
     desc = agent.description or f"Execute the {name} agent."
-    lines.append(f'@app.post("/run/{name}"{deps})')
-    lines.append(f"async def run_{name}(request: {pascal}Request):")
-    lines.append(f'    """{ desc }"""')
-    lines.append(f"    request_id = str(uuid.uuid4())[:12]")
-    lines.append(f"    try:")
-    lines.append(f"        input_state = request.model_dump()")
-    lines.append(f'        input_state["messages"] = []')
-    lines.append(f"        result = {name}_graph.invoke(input_state)")
-    lines.append(f"")
-    lines.append(f"        # Serialize messages")
-    lines.append(f"        serialized_messages = []")
-    lines.append(f'        for msg in result.get("messages", []):')
-    lines.append(f"            if hasattr(msg, 'type'):")
-    lines.append(f"                role = msg.type")
-    lines.append(f'                if role == "human":')
-    lines.append(f'                    role = "human"')
-    lines.append(f'                elif role == "ai":')
-    lines.append(f'                    role = "assistant"')
-    lines.append(f'                serialized_messages.append({{"role": role, "content": msg.content}})')
-    lines.append(f"            elif isinstance(msg, dict):")
-    lines.append(f"                serialized_messages.append(msg)")
-    lines.append(f"")
-    lines.append(f"        # Build response (only exposed fields)")
-    lines.append(f"        response_data = {{}}")
+    w(_ENDPOINT_HEAD.format(name=name, pascal=pascal, deps=deps, desc=desc))
+    for field_name, _ in exposed_fields:
+        w(f'        response_data["{field_name}"] = result.get("{field_name}")\n')
+    w(_ENDPOINT_TAIL.format(name=name))
 
-    for field in agent.state_fields:
-        if field["expose"]:
-            lines.append(f'        response_data["{field["name"]}"] = result.get("{field["name"]}")')
-    lines.append(f'        response_data["messages"] = serialized_messages')
-    lines.append(f"")
-    lines.append(f"        return response_data")
-    lines.append(f"")
-    lines.append(f"    except Exception as e:")
-    lines.append(f"        logger.exception(f\"Agent {name} failed: {{e}}\")")
-    lines.append(f'        error_detail = {{"detail": "Agent execution failed", "error_code": "R500", "agent": "{name}", "request_id": f"req_{{request_id}}"}}')
-    lines.append(f'        if os.getenv("LOG_LEVEL", "INFO") == "DEBUG":')
-    lines.append(f'            error_detail["error"] = str(e)')
-    lines.append(f"        raise HTTPException(status_code=500, detail=error_detail)")
+    return buf.getvalue()
 
-    return lines
+
+# Packages every generated server needs, regardless of agents or providers
+_BASE_REQUIREMENTS = frozenset({
+    "fastapi>=0.104.0",
+    "uvicorn[standard]>=0.24.0",
+    "pydantic>=2.0.0",
+    "pydantic-settings>=2.0.0",
+    "langgraph>=0.2.0",
+    "langchain-core>=0.2.0",
+})
+_BASE_REQUIREMENTS_TXT = "\n".join(sorted(_BASE_REQUIREMENTS)) + "\n"
 
 
 def generate_requirements_txt(project: ProjectAST, agents: dict[str, AgentAST]) -> str:
     """Generate requirements.txt with all required packages."""
-    packages = set()
-    packages.add("fastapi>=0.104.0")
-    packages.add("uvicorn[standard]>=0.24.0")
-    packages.add("pydantic>=2.0.0")
-    packages.add("pydantic-settings>=2.0.0")
-    packages.add("langgraph>=0.2.0")
-    packages.add("langchain-core>=0.2.0")
-
-    # Provider-specific packages
-    provider = project.llm_provider
-    if provider in PROVIDER_MAP:
-        _, pkg = PROVIDER_MAP[provider]
-        packages.add(f"{pkg.replace('_', '-')}>=0.1.0")
-
-    # Check agent-level overrides
-    for agent in agents.values():
-        if agent.config and agent.config.get("llm_provider"):
-            p = agent.config["llm_provider"]
-            if p in PROVIDER_MAP:
-                _, pkg = PROVIDER_MAP[p]
-                packages.add(f"{pkg.replace('_', '-')}>=0.1.0")
+    packages: set[str] = set()  # additions on top of _BASE_REQUIREMENTS
 
-    # Check for tools needing httpx/tenacity
+    # Providers in use (project default plus agent-level overrides)
+    providers = {project.llm_provider}
+    needs_httpx = needs_tenacity = False
     for agent in agents.values():
+        if agent.config and agent.config.get("llm_provider"):
+            providers.add(agent.config["llm_provider"])
+        if needs_tenacity:
+            continue
         for tool in agent.tools:
             if tool["type"] == "api_call":
-                packages.add("httpx>=0.25.0")
+                needs_httpx = True
                 if tool.get("max_retries", 0) > 0:
-                    packages.add("tenacity>=8.2.0")
+                    needs_tenacity = True
+                    break
+
+    for provider in providers:
+        if provider in PROVIDER_MAP:
+            _, pkg = PROVIDER_MAP[provider]
+            packages.add(f"{pkg.replace('_', '-')}>=0.1.0")
+
+    # Tools needing httpx/tenacity
+    if needs_httpx:
+        packages.add("httpx>=0.25.0")
+    if needs_tenacity:
+        packages.add("tenacity>=8.2.0")
 
-    return "\n".join(sorted(packages)) + "\n"
+    if not packages:
+        return _BASE_REQUIREMENTS_TXT
+    return "\n".join(sorted(_BASE_REQUIREMENTS | packages)) + "\n"
 
 
 def generate_env_example(project: ProjectAST) -> str:
@@ -264,35 +308,65 @@ def generate_env_example(project: ProjectAST) -> str:
     return "\n".join(lines) + "\n"
 
 
+@functools.lru_cache(maxsize=None)
 def _to_pascal(name: str) -> str:
     """Convert snake_case to PascalCase."""
-    return "".join(word.capitalize() for word in name.split("_"))
+    return "".join([word.capitalize() for word in name.split("_")])
+
+
+# API model types (enums are emitted as Literal[...] instead)
+_API_TYPE_MAP = {
+    "string": "str",
+    "int": "int",
+    "float": "float",
+    "bool": "bool",
+    "list": "list",
+    "dict": "dict",
+    "list[string]": "list[str]",
+    "list[int]": "list[int]",
+    "list[float]": "list[float]",
+    "list[dict]": "list[dict]",
+    "dict[string]": "dict[str, str]",
+    "dict[int]": "dict[str, int]",
+    "dict[any]": "dict",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _enum_literal(values: str) -> str:
+    """Build the Literal[...] annotation for a comma-separated enum values list."""
+    parts = [f'"{v.strip()}"' for v in values.split(",")]
+    return f"Literal[{', '.join(parts)}]"
 
 
 def _get_api_type(field: dict) -> str:
     """Get the Python type for API models (with Literal for enums)."""
-    type_map = {
-        "string": "str",
-        "int": "int",
-        "float": "float",
-        "bool": "bool",
-        "list": "list",
-        "dict": "dict",
-        "list[string]": "list[str]",
-        "list[int]": "list[int]",
-        "list[float]": "list[float]",
-        "list[dict]": "list[dict]",
-        "dict[string]": "dict[str, str]",
-        "dict[int]": "dict[str, int]",
-        "dict[any]": "dict",
-    }
-
     if field["type"] == "enum" and field.get("values"):
-        enum_values = [v.strip() for v in field["values"].split(",")]
-        literal_values = ", ".join(f'"{v}"' for v in enum_values)
-        return f"Literal[{literal_values}]"
+        return _enum_literal(field["values"])
+
+    return _API_TYPE_MAP.get(field["type"], "str")
+
+
+def _quoted(default: str) -> str:
+    """Render a default as a string literal."""
+    return f'"{default}"'
 
-    return type_map.get(field["type"], "str")
+
+def _literal(default: str) -> str:
+    """Render a default verbatim as Python source (list/dict literals)."""
+    return default
+
+
+# Default-value renderers keyed by base type (`list[string]` → `list`)
+_DEFAULT_RENDERERS = {
+    "string": _quoted,
+    "enum": _quoted,
+    "int": lambda d: str(int(d)),
+    "float": lambda d: str(float(d)),
+    "bool": lambda d: "True" if d.lower() == "true" else "False",
+    "list": _literal,
+    "dict": _literal,
+}
 
 
 def _get_python_default(field: dict) -> str:
@@ -301,21 +375,5 @@ def _get_python_default(field: dict) -> str:
     if default is None:
         return "None"
 
-    field_type = field["type"]
-    if field_type in ("string", "enum"):
-        return f'"{default}"'
-    elif field_type in ("int",):
-        return str(int(default))
-    elif field_type in ("float",):
-        return str(float(default))
-    elif field_type in ("bool",):
-        return "True" if default.lower() == "true" else "False"
-    elif field_type in ("list",) or field_type.startswith("list["):
-        if default == "[]":
-            return "[]"
-        return default
-    elif field_type in ("dict",) or field_type.startswith("dict["):
-        if default == "{}":
-            return "{}"
-        return default
-    return f'"{default}"'
+    base_type = field["type"].split("[", 1)[0]
+    return _DEFAULT_RENDERERS.get(base_type, _quoted)(default)
@@ -5,15 +5,12 @@ import os
 import sys
 
 from . import __version__
-from .assembler import generate_env_example, generate_main_py, generate_requirements_txt
-from .codegen import generate_agent_code
 from .errors import AJMLCompilationError
-from .preprocessor import count_sanitised_conditions, preprocess
+from .preprocessor import preprocess, preprocess_with_stats
 from .validator import (
     AgentAST,
     ProjectAST,
-    check_circular_dependencies,
-    check_duplicate_agent_names,
+    check_project_agents,
     validate_agent,
     validate_project,
 )
@@ -84,6 +81,10 @@ def main():
 
 def cmd_build(args) -> int:
     """Execute the build command."""
+    # Phases 3 and 4 are deferred so `init` and `validate` never load them
+    from .assembler import generate_env_example, generate_main_py, generate_requirements_txt
+    from .codegen import generate_agent_code
+
     project_dir = os.path.abspath(args.project_dir)
     output_dir = os.path.join(project_dir, args.output)
     verbose = args.verbose
@@ -122,33 +123,22 @@ def cmd_build(args) -> int:
 
     os.makedirs(output_dir, exist_ok=True)
 
-    # Generate compiled agent files
+    # Collect every artefact first, then write them out in one batch
+    files: dict[str, bytes] = {}
     for name, agent in sorted(agents.items()):
         code = generate_agent_code(agent, project, agents)
-        output_path = os.path.join(output_dir, f"compiled_{name}.py")
-        with open(output_path, "w") as f:
-            f.write(code)
-        print(f"  ✓ {args.output}/compiled_{name}.py")
+        files[os.path.join(output_dir, f"compiled_{name}.py")] = code.encode("utf-8")
+    files[os.path.join(output_dir, "main.py")] = generate_main_py(project, agents).encode("utf-8")
+    files[os.path.join(output_dir, "requirements.txt")] = (
+        generate_requirements_txt(project, agents).encode("utf-8")
+    )
+    files[os.path.join(output_dir, ".env.example")] = generate_env_example(project).encode("utf-8")
+    _write_files(files)
 
-    # Generate main.py
-    main_code = generate_main_py(project, agents)
-    main_path = os.path.join(output_dir, "main.py")
-    with open(main_path, "w") as f:
-        f.write(main_code)
+    for name in sorted(agents):
+        print(f"  ✓ {args.output}/compiled_{name}.py")
     print(f"  ✓ {args.output}/main.py ({len(agents)} endpoint{'s' if len(agents) != 1 else ''})")
-
-    # Generate requirements.txt
-    req_code = generate_requirements_txt(project, agents)
-    req_path = os.path.join(output_dir, "requirements.txt")
-    with open(req_path, "w") as f:
-        f.write(req_code)
     print(f"  ✓ {args.output}/requirements.txt")
-
-    # Generate .env.example
-    env_code = generate_env_example(project)
-    env_path = os.path.join(output_dir, ".env.example")
-    with open(env_path, "w") as f:
-        f.write(env_code)
     print(f"  ✓ {args.output}/.env.example")
 
     warning_str = f" ({len(all_warnings)} warning{'s' if len(all_warnings) != 1 else ''})" if all_warnings else ""
@@ -274,6 +264,44 @@ __pycache__/
     return 0
 
 
+def _validate_source(
+    rel_path: str, raw: str, project: ProjectAST, project_dir: str
+) -> tuple[AgentAST, list, int]:
+    """Run Phases 1 and 2 on one agent file, without cross-agent checks."""
+    root, conditions_sanitised = preprocess_with_stats(raw)
+    agent, warnings = validate_agent(root, rel_path, project, None, project_dir)
+    return agent, warnings, conditions_sanitised
+
+
+def _file_matches(path: str, data: bytes) -> bool:
+    """Check whether `path` already holds exactly `data`, comparing sizes first."""
+    try:
+        if os.stat(path).st_size != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except FileNotFoundError:
+        return False
+
+
+def _write_files(files: dict[str, bytes]):
+    """Write a batch of build artefacts with unbuffered writes straight from bytes.
+
+    Files whose content is already identical are left untouched, so an
+    unchanged rebuild neither rewrites them nor bumps their mtimes.
+    """
+    for path, data in files.items():
+        if _file_matches(path, data):
+            continue
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+
 def _compile_project(
     project_dir: str, verbose: bool = False
 ) -> tuple[ProjectAST, dict[str, AgentAST], list]:
@@ -305,40 +333,34 @@ def _compile_project(
         print(f"Project: {project.name} (ajml v{project.ajml_version})")
 
     # Scan for agent files
-    ajml_files = sorted([
-        f for f in os.listdir(agents_dir)
-        if f.endswith(".ajml") and f != "_project.ajml"
-    ])
+    with os.scandir(agents_dir) as entries:
+        ajml_files = sorted(
+            e.name for e in entries
+            if e.name.endswith(".ajml") and e.name != "_project.ajml" and e.is_file()
+        )
 
     if verbose:
         print(f"Scanning agents/ ... found {len(ajml_files)} agent file{'s' if len(ajml_files) != 1 else ''} + _project.ajml.")
         print()
 
-    # Phase 1 & 2 for each agent
+    # Phase 1 & 2 for each agent; cross-agent checks wait until all are loaded
     agents: dict[str, AgentAST] = {}
     all_warnings = []
 
     for i, ajml_file in enumerate(ajml_files, 1):
-        filepath = os.path.join(agents_dir, ajml_file)
-        rel_path = f"agents/{ajml_file}"
-
-        if verbose:
-            print(f"[{i}/{len(ajml_files)}] {ajml_file}")
-
-        with open(filepath, "r", encoding="utf-8") as f:
+        with open(os.path.join(agents_dir, ajml_file), "r", encoding="utf-8") as f:
             raw = f.read()
 
-        # Phase 1: Pre-process
-        conditions_sanitised = count_sanitised_conditions(raw)
-        root = preprocess(raw)
+        agent, warnings, conditions_sanitised = _validate_source(
+            f"agents/{ajml_file}", raw, project, project_dir
+        )
         if verbose:
+            print(f"[{i}/{len(ajml_files)}] {ajml_file}")
             if conditions_sanitised > 0:
                 print(f"  ✓ Pre-processed ({conditions_sanitised} condition{'s' if conditions_sanitised != 1 else ''} sanitised)")
             else:
                 print(f"  ✓ Pre-processed")
 
-        # Phase 2: Validate
-        agent, warnings = validate_agent(root, rel_path, project, agents, project_dir)
         agents[agent.name] = agent
         all_warnings.extend(warnings)
 
@@ -346,7 +368,7 @@ def _compile_project(
             node_count = len(agent.nodes)
             edge_count = len(agent.edges)
             tool_count = len(agent.tools)
-            subgraph_count = sum(1 for n in agent.nodes if n["type"] == "subgraph")
+            subgraph_count = len(agent.subgraph_refs)
             parts = [f"{node_count} node{'s' if node_count != 1 else ''}"]
             parts.append(f"{edge_count} edge{'s' if edge_count != 1 else ''}")
             parts.append(f"{tool_count} tool{'s' if tool_count != 1 else ''}")
@@ -358,19 +380,6 @@ def _compile_project(
                 print(f"  ⚠ {w}")
 
     # Cross-agent checks
-    check_duplicate_agent_names(agents)
-    check_circular_dependencies(agents)
-
-    # Second pass for subgraph validation now that all agents are loaded
-    for name, agent in agents.items():
-        for node in agent.nodes:
-            if node["type"] == "subgraph":
-                agent_ref = node["agent_ref"]
-                if agent_ref not in agents:
-                    raise AJMLCompilationError(
-                        "E309",
-                        f"Agent reference `{agent_ref}` does not match any .ajml file in the project.",
-                        agent.filename,
-                    )
+    check_project_agents(agents)
 
     return project, agents, all_warnings
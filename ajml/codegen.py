@@ -3,8 +3,10 @@
 Emits Python source code from validated AJML ASTs.
 """
 
+import functools
 import re
-from typing import Any
+from collections import defaultdict
+from typing import Any, Callable
 
 from .validator import AgentAST, ProjectAST
 
@@ -26,6 +28,32 @@ TYPE_MAP = {
     "dict[any]": "dict",
 }
 
+# ${field} state interpolation and ${env:VAR} environment placeholders
+_INTERP_RE = re.compile(r"\$\{(\w+)\}")
+_ENV_RE = re.compile(r"\$\{env:(\w+)\}")
+
+# Replacement templates turning placeholders into f-string expressions
+_INTERP_REPL = r"{state.get('\1', '')}"
+_ENV_REPL = r"{os.getenv('\1')}"
+
+# AgentState field line per reducer (reducers are checked by the validator)
+_REDUCER_TEMPLATES = {
+    "overwrite": "    {name}: {py_type}",
+    "append": "    {name}: Annotated[{py_type}, operator.add]",
+    "add": "    {name}: Annotated[{py_type}, operator.add]",
+    "merge": "    {name}: Annotated[{py_type}, lambda a, b: {{**a, **b}}]",
+    "concat": "    {name}: Annotated[{py_type}, operator.concat]",
+}
+
+# Fixed boilerplate emitted as single entries of the joined line list
+_TOOL_EXECUTION_ERROR_BLOCK = "class ToolExecutionError(Exception):\n    pass\n\n"
+_STATE_HEADER_BLOCK = "class AgentState(TypedDict):\n    messages: Annotated[list, add_messages]"
+_COMPILE_FOOTER_BLOCK = "# Compile\ngraph = graph_builder.compile()\n"
+
+# Tool-loop router fall-through, including the two blank lines after the function
+_ROUTE_RETURN_TEMPLATE = '    return "%s"\n\n'
+_ROUTE_RETURN_END_BLOCK = '    return "__end__"\n\n'
+
 # Provider to LangChain class mapping
 PROVIDER_MAP = {
     "openai": ("ChatOpenAI", "langchain_openai"),
@@ -39,9 +67,10 @@ PROVIDER_MAP = {
 }
 
 
+@functools.lru_cache(maxsize=None)
 def _to_pascal_case(snake_str: str) -> str:
     """Convert snake_case to PascalCase."""
-    return "".join(word.capitalize() for word in snake_str.split("_"))
+    return "".join([word.capitalize() for word in snake_str.split("_")])
 
 
 def _interpolate_prompt(prompt: str) -> str:
@@ -56,11 +85,7 @@ def _interpolate_prompt(prompt: str) -> str:
     result_parts = []
     for line in lines:
         # Replace ${field_name} with {state.get('field_name', '')}
-        converted = re.sub(
-            r"\$\{(\w+)\}",
-            lambda m: "{state.get('" + m.group(1) + "', '')}",
-            line,
-        )
+        converted = _INTERP_RE.sub(_INTERP_REPL, line)
         result_parts.append(converted)
 
     joined = "\\n".join(result_parts)
@@ -72,29 +97,82 @@ def _interpolate_prompt_multiline(prompt: str) -> str:
     if not prompt:
         return '    system_content = ""\n'
 
-    lines = prompt.split("\n")
-    parts = []
-    for i, line in enumerate(lines):
-        converted = re.sub(
-            r"\$\{(\w+)\}",
-            lambda m: "{state.get('" + m.group(1) + "', '')}",
-            line,
-        )
-        # Escape any double quotes in the line
-        converted = converted.replace('"', '\\"')
-        parts.append(converted)
-
-    if len(parts) == 1:
-        return f'    system_content = f"{parts[0]}"\n'
+    # Placeholders never span lines, so convert and escape double quotes
+    # over the whole prompt before splitting it into f-string lines
+    *head, last = _INTERP_RE.sub(_INTERP_REPL, prompt).replace('"', '\\"').split("\n")
+    if not head:
+        return f'    system_content = f"{last}"\n'
+
+    out = ["    system_content = (\n"]
+    for line in head:
+        out.append(f'        f"{line}\\n"\n')
+    out.append(f'        f"{last}"\n')
+    out.append("    )\n")
+    return "".join(out)
+
+
+# Imports every generated agent module needs
+_BASE_LC_IMPORTS = (
+    "from langchain_core.messages import AIMessage, SystemMessage",
+    "from langgraph.graph import END, START, StateGraph",
+    "from langgraph.graph.message import add_messages",
+)
+
+# Reducers emitted as operator.add
+_OPERATOR_ADD_REDUCERS = frozenset({"append", "add"})
+
+
+class _CodegenNeeds:
+    """Imports and helpers an agent's generated module requires."""
+
+    def __init__(self):
+        self.operator = False
+        self.concat = False
+        self.structured_output = False
+        self.tool_node = False
+        self.httpx = False  # any api_call tool (also needs logging/os)
+        self.any_tools = False
+        self.send = False
+        self.state_filter = False  # a node filters results down to state fields
+        self.tenacity_parts: set[str] = set()  # empty unless an api_call tool retries
+
+
+def _scan_agent(agent: AgentAST) -> _CodegenNeeds:
+    """Work out an agent's import needs with one pass over each AST section."""
+    needs = _CodegenNeeds()
+
+    for f in agent.state_fields:
+        reducer = f["reducer"]
+        if reducer in _OPERATOR_ADD_REDUCERS:
+            needs.operator = True
+        elif reducer == "concat":
+            needs.concat = True
+
+    for n in agent.nodes:
+        node_type = n["type"]
+        if node_type == "llm":
+            if n.get("output_schema"):
+                needs.structured_output = True
+                if not n.get("tool_binds"):
+                    needs.state_filter = True
+            if n.get("tool_binds"):
+                needs.tool_node = True
+        elif node_type in {"action", "script"}:
+            needs.state_filter = True
+
+    needs.any_tools = bool(agent.tools)
+    for t in agent.tools:
+        if t["type"] == "api_call":
+            needs.httpx = True
+            if t.get("max_retries", 0) > 0:
+                needs.tenacity_parts.update(("retry", "stop_after_attempt", "retry_if_exception_type"))
+                if t.get("backoff", "exponential") == "exponential":
+                    needs.tenacity_parts.add("wait_exponential")
+                else:
+                    needs.tenacity_parts.add("wait_fixed")
 
-    result = "    system_content = (\n"
-    for i, part in enumerate(parts):
-        if i < len(parts) - 1:
-            result += f'        f"{part}\\n"\n'
-        else:
-            result += f'        f"{part}"\n'
-    result += "    )\n"
-    return result
+    needs.send = any(e["type"] == "map" for e in agent.edges)
+    return needs
 
 
 def generate_agent_code(
@@ -109,6 +187,7 @@ def generate_agent_code(
     """
     all_agents = all_agents or {}
     lines: list[str] = []
+    append = lines.append
 
     # Determine LLM config (agent override or project default)
     provider = project.llm_provider
@@ -120,221 +199,162 @@ def generate_agent_code(
         max_retries = agent.config.get("llm_max_retries", max_retries)
 
     # Collect what we need to import
-    needs_operator = any(
-        f["reducer"] in ("append", "add") for f in agent.state_fields
-    )
-    needs_concat = any(f["reducer"] == "concat" for f in agent.state_fields)
-    needs_structured_output = any(
-        n["type"] == "llm" and n.get("output_schema") for n in agent.nodes
-    )
-    needs_tool_node = any(
-        n["type"] == "llm" and n.get("tool_binds") for n in agent.nodes
-    )
-    needs_httpx = any(t["type"] == "api_call" for t in agent.tools)
-    needs_tenacity = any(
-        t["type"] == "api_call" and t.get("max_retries", 0) > 0
-        for t in agent.tools
-    )
-    needs_send = any(e["type"] == "map" for e in agent.edges)
-    has_api_tools = any(t["type"] == "api_call" for t in agent.tools)
-    has_any_tools = len(agent.tools) > 0
+    needs = _scan_agent(agent)
 
     # --- Imports ---
     imports = []
-    if needs_operator or needs_concat:
+    if needs.operator or needs.concat:
         imports.append("import operator")
-    if needs_httpx or has_api_tools:
+    if needs.httpx:
         imports.append("import logging")
         imports.append("import os")
-    if needs_httpx:
         imports.append("")
         imports.append("import httpx")
 
     imports.append("")
     imports.append("from typing import Annotated, TypedDict")
 
-    # LangChain/LangGraph imports
-    lc_imports = set()
-    lc_imports.add("from langchain_core.messages import AIMessage, SystemMessage")
-    if has_any_tools:
-        lc_imports.add("from langchain_core.tools import tool")
-    if needs_structured_output:
-        lc_imports.add("from pydantic import BaseModel, Field")
-    elif has_api_tools:
-        lc_imports.add("from pydantic import BaseModel, Field")
-    if needs_tool_node:
-        lc_imports.add("from langgraph.prebuilt import ToolNode")
-    if needs_send:
-        lc_imports.add("from langgraph.constants import Send")
-    if needs_tenacity:
-        tenacity_parts = ["retry", "stop_after_attempt"]
-        # Check backoff strategies
-        for t in agent.tools:
-            if t["type"] == "api_call" and t.get("max_retries", 0) > 0:
-                if t.get("backoff", "exponential") == "exponential":
-                    if "wait_exponential" not in tenacity_parts:
-                        tenacity_parts.append("wait_exponential")
-                else:
-                    if "wait_fixed" not in tenacity_parts:
-                        tenacity_parts.append("wait_fixed")
-                tenacity_parts.append("retry_if_exception_type")
-        tenacity_parts = sorted(set(tenacity_parts))
-        lc_imports.add(
-            f"from tenacity import {', '.join(tenacity_parts)}"
+    # LangChain/LangGraph imports (each flag contributes a distinct line)
+    lc_imports: list[str] = list(_BASE_LC_IMPORTS)
+    if needs.any_tools:
+        lc_imports.append("from langchain_core.tools import tool")
+    if needs.structured_output or needs.httpx:
+        lc_imports.append("from pydantic import BaseModel, Field")
+    if needs.tool_node:
+        lc_imports.append("from langgraph.prebuilt import ToolNode")
+    if needs.send:
+        lc_imports.append("from langgraph.constants import Send")
+    if needs.tenacity_parts:
+        lc_imports.append(
+            f"from tenacity import {', '.join(sorted(needs.tenacity_parts))}"
         )
 
-    lc_imports.add("from langgraph.graph import END, START, StateGraph")
-    lc_imports.add("from langgraph.graph.message import add_messages")
-
     # Provider import
-    if provider in PROVIDER_MAP:
-        cls_name, pkg_name = PROVIDER_MAP[provider]
-        lc_imports.add(f"from {pkg_name} import {cls_name}")
+    provider_cls = PROVIDER_MAP.get(provider)
+    if provider_cls:
+        cls_name, pkg_name = provider_cls
+        lc_imports.append(f"from {pkg_name} import {cls_name}")
 
-    imports.extend(sorted(lc_imports))
+    lc_imports.sort()
+    imports.extend(lc_imports)
 
     lines.extend(imports)
-    lines.append("")
+    append("")
 
-    if has_api_tools:
-        lines.append("")
-        lines.append("logger = logging.getLogger(__name__)")
+    if needs.httpx:
+        append("")
+        append("logger = logging.getLogger(__name__)")
 
-    lines.append("")
-    lines.append("")
+    append("")
+    append("")
 
     # --- ToolExecutionError ---
-    if has_api_tools:
-        lines.append("class ToolExecutionError(Exception):")
-        lines.append("    pass")
-        lines.append("")
-        lines.append("")
+    if needs.httpx:
+        append(_TOOL_EXECUTION_ERROR_BLOCK)
 
     # --- State TypedDict ---
-    lines.append("class AgentState(TypedDict):")
-    lines.append("    messages: Annotated[list, add_messages]")
+    append(_STATE_HEADER_BLOCK)
+    get_type = TYPE_MAP.get
     for field in agent.state_fields:
-        py_type = TYPE_MAP.get(field["type"], "str")
-        reducer = field["reducer"]
-        if reducer == "overwrite":
-            lines.append(f"    {field['name']}: {py_type}")
-        elif reducer == "append":
-            lines.append(f"    {field['name']}: Annotated[{py_type}, operator.add]")
-        elif reducer == "add":
-            lines.append(f"    {field['name']}: Annotated[{py_type}, operator.add]")
-        elif reducer == "merge":
-            lines.append(f"    {field['name']}: Annotated[{py_type}, lambda a, b: {{**a, **b}}]")
-        elif reducer == "concat":
-            lines.append(f"    {field['name']}: Annotated[{py_type}, operator.concat]")
-    lines.append("")
-    lines.append("")
+        append(_REDUCER_TEMPLATES[field["reducer"]].format(
+            name=field["name"], py_type=get_type(field["type"], "str"),
+        ))
+    append("")
+    append("")
+
+    # Field names are known here, so node result filters test a literal set
+    # instead of AgentState.__annotations__ at runtime.
+    if needs.state_filter:
+        state_keys = ", ".join(['"messages"'] + [f'"{f["name"]}"' for f in agent.state_fields])
+        append(f"_STATE_KEYS = frozenset({{{state_keys}}})")
+        append("")
+        append("")
 
     # --- LLM initialization ---
-    if provider in PROVIDER_MAP:
-        cls_name, _ = PROVIDER_MAP[provider]
-        lines.append(f'llm = {cls_name}(model="{model}", max_retries={max_retries})')
+    if provider_cls:
+        cls_name, _ = provider_cls
+        append(f'llm = {cls_name}(model="{model}", max_retries={max_retries})')
     else:
-        lines.append(f'# LLM provider "{provider}" — configure manually')
-        lines.append("llm = None")
-    lines.append("")
-    lines.append("")
+        append(f'# LLM provider "{provider}" — configure manually')
+        append("llm = None")
+    append("")
+    append("")
 
     # --- Tool definitions ---
     for tool_def in agent.tools:
-        lines.extend(_generate_tool(tool_def))
-        lines.append("")
-        lines.append("")
+        _generate_tool(tool_def, lines)
+        append("")
+        append("")
 
     # --- Node functions ---
     for node in agent.nodes:
-        lines.extend(_generate_node(node, agent))
-        lines.append("")
-        lines.append("")
+        _generate_node(node, agent, lines)
+        append("")
+        append("")
 
     # --- Routing functions ---
-    lines.extend(_generate_routing_functions(agent))
+    edge_groups = _group_edges(agent)
+    _generate_routing_functions(agent, edge_groups, lines)
 
     # --- Graph assembly ---
-    lines.append("graph_builder = StateGraph(AgentState)")
-    lines.append("")
+    append("graph_builder = StateGraph(AgentState)")
+    append("")
 
-    # Add nodes
-    lines.append("# Add all nodes")
+    # Add nodes (tool-calling loop edges are collected in the same pass)
+    append("# Add all nodes")
+    tool_loop_lines: list[str] = []
     for node in agent.nodes:
         node_id = node["id"]
-        lines.append(f'graph_builder.add_node("{node_id}", {node_id})')
+        append(f'graph_builder.add_node("{node_id}", {node_id})')
         # If LLM node with tool binds, also add tool node
         if node["type"] == "llm" and node.get("tool_binds"):
-            lines.append(f'graph_builder.add_node("{node_id}_tools", {node_id}_tools)')
-    lines.append("")
+            append(f'graph_builder.add_node("{node_id}_tools", {node_id}_tools)')
+            tool_loop_lines.append(
+                f'graph_builder.add_conditional_edges("{node_id}", route_{node_id})'
+            )
+            tool_loop_lines.append(
+                f'graph_builder.add_edge("{node_id}_tools", "{node_id}")'
+            )
+    append("")
 
     # Add edges
-    lines.append("# Add edges")
-    edge_groups: dict[str, list[dict]] = {}
-    for edge in agent.edges:
-        source = edge["source"]
-        if source not in edge_groups:
-            edge_groups[source] = []
-        edge_groups[source].append(edge)
-
-    for source, edges in edge_groups.items():
+    append("# Add edges")
+    for source, (edges, has_conditions, has_map) in edge_groups.items():
         source_py = "START" if source == "__START__" else f'"{source}"'
 
-        # Check if this is a conditional group
-        has_conditions = any(e["condition"] for e in edges)
-        has_map = any(e["type"] == "map" for e in edges)
-
         if has_conditions:
-            lines.append(f"graph_builder.add_conditional_edges({source_py}, route_{source.replace('__START__', 'start')})")
+            append(f"graph_builder.add_conditional_edges({source_py}, route_{source.replace('__START__', 'start')})")
         elif has_map:
             map_edge = edges[0]
             target = map_edge["target"]
-            lines.append(
+            append(
                 f'graph_builder.add_conditional_edges({source_py}, route_{source}, ["{target}"])'
             )
         else:
             for edge in edges:
                 target = edge["target"]
                 target_py = "END" if target == "__END__" else f'"{target}"'
-                lines.append(f"graph_builder.add_edge({source_py}, {target_py})")
+                append(f"graph_builder.add_edge({source_py}, {target_py})")
 
     # Add tool-calling loop edges for LLM nodes with tool binds
-    for node in agent.nodes:
-        if node["type"] == "llm" and node.get("tool_binds"):
-            node_id = node["id"]
-            lines.append(
-                f'graph_builder.add_conditional_edges("{node_id}", route_{node_id})'
-            )
-            lines.append(
-                f'graph_builder.add_edge("{node_id}_tools", "{node_id}")'
-            )
+    lines.extend(tool_loop_lines)
 
-    lines.append("")
-    lines.append("# Compile")
-    lines.append("graph = graph_builder.compile()")
-    lines.append("")
+    append("")
+    append(_COMPILE_FOOTER_BLOCK)
 
     return "\n".join(lines)
 
 
-def _generate_tool(tool_def: dict[str, Any]) -> list[str]:
+def _generate_tool(tool_def: dict[str, Any], lines: list[str]) -> None:
     """Generate code for a tool definition."""
-    lines: list[str] = []
-    tool_type = tool_def["type"]
-
-    if tool_type == "api_call":
-        lines.extend(_generate_api_tool(tool_def))
-    elif tool_type == "local_script":
-        lines.extend(_generate_local_script_tool(tool_def))
-    elif tool_type == "script_tool":
-        lines.extend(_generate_script_tool(tool_def))
+    emitter = _TOOL_EMITTERS.get(tool_def["type"])
+    if emitter:
+        emitter(tool_def, lines)
 
-    return lines
 
-
-def _generate_api_tool(tool_def: dict[str, Any]) -> list[str]:
+def _generate_api_tool(tool_def: dict[str, Any], lines: list[str]) -> None:
     """Generate code for an api_call tool."""
-    lines: list[str] = []
+    get_type = TYPE_MAP.get
     tool_id = tool_def["id"]
     pascal_name = _to_pascal_case(tool_id)
 
@@ -343,7 +363,7 @@ def _generate_api_tool(tool_def: dict[str, Any]) -> list[str]:
     params = tool_def.get("parameters", [])
     if params:
         for param in params:
-            py_type = TYPE_MAP.get(param["type"], "str")
+            py_type = get_type(param["type"], "str")
             desc = param.get("description", "")
             if desc:
                 lines.append(f'    {param["name"]}: {py_type} = Field(description="{desc}")')
@@ -378,7 +398,7 @@ def _generate_api_tool(tool_def: dict[str, Any]) -> list[str]:
     # Function signature
     param_strs = []
     for param in params:
-        py_type = TYPE_MAP.get(param["type"], "str")
+        py_type = get_type(param["type"], "str")
         param_strs.append(f'{param["name"]}: {py_type}')
     lines.append(f'def {tool_id}({", ".join(param_strs)}) -> dict:')
 
@@ -389,13 +409,15 @@ def _generate_api_tool(tool_def: dict[str, Any]) -> list[str]:
     # Build URL
     url = tool_def.get("url", "")
     # Replace ${param} with f-string
-    url_py = re.sub(r"\$\{env:(\w+)\}", lambda m: "{os.getenv('" + m.group(1) + "')}", url)
+    url_py = _ENV_RE.sub(_ENV_REPL, url)
     # Map path parameters
     for param in params:
         if param.get("in") == "path":
             map_to = param.get("map_to", param["name"])
             url_py = url_py.replace(f"${{{map_to}}}", f"{{{param['name']}}}")
-    lines.append(f'    url = f"{url_py}"')
+    # Without placeholders there is nothing to interpolate: emit a plain literal
+    prefix = "f" if "{" in url_py else ""
+    lines.append(f'    url = {prefix}"{url_py}"')
 
     # Headers
     headers = tool_def.get("headers", [])
@@ -404,12 +426,9 @@ def _generate_api_tool(tool_def: dict[str, Any]) -> list[str]:
         for h in headers:
             val = h["value"]
             # Replace ${env:VAR} in header values
-            val_py = re.sub(
-                r"\$\{env:(\w+)\}",
-                lambda m: "{os.getenv('" + m.group(1) + "')}",
-                val,
-            )
-            lines.append(f'        "{h["name"]}": f"{val_py}",')
+            val_py = _ENV_RE.sub(_ENV_REPL, val)
+            prefix = "f" if "{" in val_py else ""
+            lines.append(f'        "{h["name"]}": {prefix}"{val_py}",')
         lines.append("    }")
 
     # Query params
@@ -444,7 +463,7 @@ def _generate_api_tool(tool_def: dict[str, Any]) -> list[str]:
 
     # Retry status codes check
     if max_retries > 0:
-        codes_tuple = ", ".join(str(c) for c in retry_codes)
+        codes_tuple = ", ".join([str(c) for c in retry_codes])
         lines.append(f"    # Raise for retryable status codes")
         lines.append(f"    if response.status_code in ({codes_tuple}):")
         lines.append("        response.raise_for_status()")
@@ -480,25 +499,21 @@ def _generate_api_tool(tool_def: dict[str, Any]) -> list[str]:
             else:
                 # Nested access
                 var_name = state_field
-                access_code = "data"
-                for part in parts[:-1]:
-                    access_code += f'.get("{part}", {{}})'
-                access_code += f'.get("{parts[-1]}")'
+                access_code = "data" + "".join(
+                    [f'.get("{part}", {{}})' for part in parts[:-1]]
+                ) + f'.get("{parts[-1]}")'
                 lines.append(f'    {var_name} = {access_code}')
                 lines.append(f'    if {var_name} is None:')
                 lines.append(f'        logger.warning("{tool_id}: API field \'{api_field}\' not found in response")')
         lines.append("")
-        result_dict = ", ".join(f'"{r["state_field"]}": {r["state_field"]}' for r in returns)
+        result_dict = ", ".join([f'"{r["state_field"]}": {r["state_field"]}' for r in returns])
         lines.append(f"    return {{{result_dict}}}")
     else:
         lines.append("    return data")
 
-    return lines
-
 
-def _generate_local_script_tool(tool_def: dict[str, Any]) -> list[str]:
+def _generate_local_script_tool(tool_def: dict[str, Any], lines: list[str]) -> None:
     """Generate code for a local_script tool."""
-    lines: list[str] = []
     tool_id = tool_def["id"]
     path = tool_def["path"]
     module_name = path.replace(".py", "").replace("/", ".")
@@ -524,12 +539,9 @@ def _generate_local_script_tool(tool_def: dict[str, Any]) -> list[str]:
     lines.append(f'    """{desc}"""')
     lines.append(f"    return _{tool_id}_module.run(**kwargs)")
 
-    return lines
 
-
-def _generate_script_tool(tool_def: dict[str, Any]) -> list[str]:
+def _generate_script_tool(tool_def: dict[str, Any], lines: list[str]) -> None:
     """Generate code for a script_tool."""
-    lines: list[str] = []
     tool_id = tool_def["id"]
     src = tool_def["src"]
     module_name = src.replace(".py", "").replace("/", ".")
@@ -542,11 +554,12 @@ def _generate_script_tool(tool_def: dict[str, Any]) -> list[str]:
     lines.append("")
 
     # Build input model from AJML parameters
+    get_type = TYPE_MAP.get
     pascal_name = _to_pascal_case(tool_id)
     lines.append(f"class {pascal_name}Input(BaseModel):")
     if params:
         for param in params:
-            py_type = TYPE_MAP.get(param["type"], "str")
+            py_type = get_type(param["type"], "str")
             p_desc = param.get("description", "")
             if p_desc:
                 lines.append(f'    {param["name"]}: {py_type} = Field(description="{p_desc}")')
@@ -560,7 +573,7 @@ def _generate_script_tool(tool_def: dict[str, Any]) -> list[str]:
     # Function
     param_strs = []
     for param in params:
-        py_type = TYPE_MAP.get(param["type"], "str")
+        py_type = get_type(param["type"], "str")
         param_strs.append(f'{param["name"]}: {py_type}')
     sig = ", ".join(param_strs)
 
@@ -568,48 +581,45 @@ def _generate_script_tool(tool_def: dict[str, Any]) -> list[str]:
     lines.append(f"def {tool_id}({sig}) -> dict:")
     lines.append(f'    """{desc}"""')
     if param_strs:
-        kw_args = ", ".join(f'{p["name"]}={p["name"]}' for p in params)
+        kw_args = ", ".join([f'{p["name"]}={p["name"]}' for p in params])
         lines.append(f"    return _{tool_id}_module.run({kw_args})")
     else:
         lines.append(f"    return _{tool_id}_module.run()")
 
-    return lines
 
+_TOOL_EMITTERS: dict[str, Callable[[dict[str, Any], list[str]], None]] = {
+    "api_call": _generate_api_tool,
+    "local_script": _generate_local_script_tool,
+    "script_tool": _generate_script_tool,
+}
 
-def _generate_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
-    """Generate code for a node function."""
-    node_type = node["type"]
 
-    if node_type == "llm":
-        return _generate_llm_node(node, agent)
-    elif node_type == "action":
-        return _generate_action_node(node, agent)
-    elif node_type == "script":
-        return _generate_script_node(node, agent)
-    elif node_type == "subgraph":
-        return _generate_subgraph_node(node, agent)
-    return []
+def _generate_node(node: dict[str, Any], agent: AgentAST, lines: list[str]) -> None:
+    """Generate code for a node function."""
+    emitter = _NODE_EMITTERS.get(node["type"])
+    if emitter:
+        emitter(node, agent, lines)
 
 
-def _generate_llm_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
+def _generate_llm_node(node: dict[str, Any], agent: AgentAST, lines: list[str]) -> None:
     """Generate code for an LLM node."""
-    lines: list[str] = []
     node_id = node["id"]
     prompt = node.get("system_prompt", "")
     output_schema = node.get("output_schema", [])
     tool_binds = node.get("tool_binds", [])
+    pascal_name = _to_pascal_case(node_id)
 
     # Output schema model
     if output_schema:
-        pascal_name = _to_pascal_case(node_id)
+        get_type = TYPE_MAP.get
         lines.append(f"class {pascal_name}Output(BaseModel):")
         for field in output_schema:
             field_type = field.get("type", "string")
-            py_type = TYPE_MAP.get(field_type, "str")
+            py_type = get_type(field_type, "str")
             # Handle enum type in output_schema
             if field_type == "enum" and field.get("values"):
                 enum_values = [v.strip() for v in field["values"].split(",")]
-                literal_values = ", ".join(f'"{v}"' for v in enum_values)
+                literal_values = ", ".join([f'"{v}"' for v in enum_values])
                 py_type = f"Literal[{literal_values}]"
             desc = field.get("description", "")
             if desc:
@@ -633,15 +643,11 @@ def _generate_llm_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
 
     if output_schema and not tool_binds:
         # Structured output
-        pascal_name = _to_pascal_case(node_id)
         lines.append(f"    structured_llm = llm.with_structured_output({pascal_name}Output)")
         lines.append("    result = structured_llm.invoke(messages)")
         lines.append("")
-        lines.append("    updates = {}")
         lines.append("    result_dict = result.model_dump()")
-        lines.append("    for key, value in result_dict.items():")
-        lines.append("        if key in AgentState.__annotations__:")
-        lines.append("            updates[key] = value")
+        lines.append("    updates = {k: v for k, v in result_dict.items() if k in _STATE_KEYS}")
         lines.append("")
         lines.append('    updates["messages"] = [AIMessage(content=str(result_dict))]')
         lines.append("    return updates")
@@ -665,12 +671,9 @@ def _generate_llm_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
         lines.append("")
         lines.append('    return {"messages": [response]}')
 
-    return lines
 
-
-def _generate_action_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
+def _generate_action_node(node: dict[str, Any], agent: AgentAST, lines: list[str]) -> None:
     """Generate code for an action node."""
-    lines: list[str] = []
     node_id = node["id"]
     tool_ref = node["tool_ref"]
 
@@ -689,24 +692,18 @@ def _generate_action_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
         for param in params:
             state_key = param["name"]
             invoke_dict[state_key] = f"state.get(\"{state_key}\")"
-        dict_parts = ", ".join(f'"{k}": {v}' for k, v in invoke_dict.items())
+        dict_parts = ", ".join([f'"{k}": {v}' for k, v in invoke_dict.items()])
         lines.append(f"    result = {tool_ref}.invoke({{{dict_parts}}})")
     else:
         lines.append(f"    result = {tool_ref}.invoke({{}})")
 
     lines.append("    # Filter to known state fields only")
-    lines.append("    updates = {}")
-    lines.append("    for key, value in result.items():")
-    lines.append("        if key in AgentState.__annotations__:")
-    lines.append("            updates[key] = value")
+    lines.append("    updates = {k: v for k, v in result.items() if k in _STATE_KEYS}")
     lines.append("    return updates")
 
-    return lines
-
 
-def _generate_script_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
+def _generate_script_node(node: dict[str, Any], agent: AgentAST, lines: list[str]) -> None:
     """Generate code for a script node."""
-    lines: list[str] = []
     node_id = node["id"]
     path = node["path"]
     module_name = path.replace(".py", "").replace("/", ".")
@@ -719,18 +716,12 @@ def _generate_script_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
     lines.append(f"def {node_id}(state: AgentState):")
     lines.append(f"    result = _{node_id}_module.run(dict(state))")
     lines.append("    # Filter to known state fields only")
-    lines.append("    updates = {}")
-    lines.append("    for key, value in result.items():")
-    lines.append("        if key in AgentState.__annotations__:")
-    lines.append("            updates[key] = value")
+    lines.append("    updates = {k: v for k, v in result.items() if k in _STATE_KEYS}")
     lines.append("    return updates")
 
-    return lines
-
 
-def _generate_subgraph_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
+def _generate_subgraph_node(node: dict[str, Any], agent: AgentAST, lines: list[str]) -> None:
     """Generate code for a subgraph node."""
-    lines: list[str] = []
     node_id = node["id"]
     agent_ref = node["agent_ref"]
     input_map = node.get("input_map", [])
@@ -757,37 +748,58 @@ def _generate_subgraph_node(node: dict[str, Any], agent: AgentAST) -> list[str]:
         lines.append(f'    updates["{mapping["target"]}"] = child_result.get("{mapping["source"]}")')
     lines.append("    return updates")
 
-    return lines
 
+_NODE_EMITTERS: dict[str, Callable[[dict[str, Any], AgentAST, list[str]], None]] = {
+    "llm": _generate_llm_node,
+    "action": _generate_action_node,
+    "script": _generate_script_node,
+    "subgraph": _generate_subgraph_node,
+}
 
-def _generate_routing_functions(agent: AgentAST) -> list[str]:
-    """Generate routing functions for conditional edges and tool-calling loops."""
-    lines: list[str] = []
 
-    # Group edges by source
-    edge_groups: dict[str, list[dict]] = {}
+def _group_edges(
+    agent: AgentAST,
+) -> dict[str, tuple[list[dict[str, Any]], bool, bool]]:
+    """Group edges by source, in declaration order.
+
+    Returns:
+        Dict of source -> (edges, has_conditions, has_map).
+    """
+    edge_groups: dict[str, list[dict]] = defaultdict(list)
     for edge in agent.edges:
-        source = edge["source"]
-        if source not in edge_groups:
-            edge_groups[source] = []
-        edge_groups[source].append(edge)
+        edge_groups[edge["source"]].append(edge)
+
+    return {
+        source: (
+            edges,
+            any(e["condition"] for e in edges),
+            any(e["type"] == "map" for e in edges),
+        )
+        for source, edges in edge_groups.items()
+    }
 
-    # Conditional routing functions
-    for source, edges in edge_groups.items():
-        has_conditions = any(e["condition"] for e in edges)
-        has_map = any(e["type"] == "map" for e in edges)
 
+def _generate_routing_functions(
+    agent: AgentAST,
+    edge_groups: dict[str, tuple[list[dict[str, Any]], bool, bool]],
+    lines: list[str],
+) -> None:
+    """Generate routing functions for conditional edges and tool-calling loops."""
+    append = lines.append
+
+    # Conditional routing functions
+    for source, (edges, has_conditions, has_map) in edge_groups.items():
         if has_conditions:
             func_name = f"route_{source.replace('__START__', 'start')}"
-            lines.append(f"def {func_name}(state: AgentState):")
+            append(f"def {func_name}(state: AgentState):")
             for edge in edges:
                 if edge["condition"]:
-                    lines.append(f"    if {edge['condition']}:")
-                    lines.append(f'        return "{edge["target"]}"')
+                    append(f"    if {edge['condition']}:")
+                    append(f'        return "{edge["target"]}"')
                 elif edge["default"]:
-                    lines.append(f'    return "{edge["target"]}"')
-            lines.append("")
-            lines.append("")
+                    append(f'    return "{edge["target"]}"')
+            append("")
+            append("")
 
         elif has_map:
             map_edge = edges[0]
@@ -796,39 +808,29 @@ def _generate_routing_functions(agent: AgentAST) -> list[str]:
             item_var = mc["item_var"]
             target = map_edge["target"]
 
-            lines.append(f"def route_{source}(state: AgentState):")
-            lines.append(f'    items = state.get("{items_field}", [])')
-            lines.append("    if not items:")
-            lines.append("        return []  # Skip — empty list")
-            lines.append("    return [")
-            lines.append(f'        Send("{target}", {{**state, "{item_var}": item}})')
-            lines.append("        for item in items")
-            lines.append("    ]")
-            lines.append("")
-            lines.append("")
+            append(f"def route_{source}(state: AgentState):")
+            append(f'    items = state.get("{items_field}", [])')
+            append("    if not items:")
+            append("        return []  # Skip — empty list")
+            append("    return [")
+            append(f'        Send("{target}", {{**state, "{item_var}": item}})')
+            append("        for item in items")
+            append("    ]")
+            append("")
+            append("")
 
     # Tool-calling loop routing functions
     for node in agent.nodes:
         if node["type"] == "llm" and node.get("tool_binds"):
             node_id = node["id"]
-            lines.append(f"def route_{node_id}(state: AgentState):")
-            lines.append('    last_message = state["messages"][-1]')
-            lines.append("    if hasattr(last_message, \"tool_calls\") and last_message.tool_calls:")
-            lines.append(f'        return "{node_id}_tools"')
-
-            # Find where this node's outgoing edges go
-            next_targets = []
-            for edge in agent.edges:
-                if edge["source"] == node_id:
-                    next_targets.append(edge["target"])
-
-            if len(next_targets) == 1:
-                target = next_targets[0]
-                target_py = "__end__" if target == "__END__" else target
-                lines.append(f'    return "{target_py}"')
+            append(f"def route_{node_id}(state: AgentState):")
+            append('    last_message = state["messages"][-1]')
+            append("    if hasattr(last_message, \"tool_calls\") and last_message.tool_calls:")
+            append(f'        return "{node_id}_tools"')
+
+            # Leave the loop for the node's single outgoing edge, or end the graph
+            next_edges = edge_groups[node_id][0] if node_id in edge_groups else ()
+            if len(next_edges) == 1 and next_edges[0]["target"] != "__END__":
+                append(_ROUTE_RETURN_TEMPLATE % next_edges[0]["target"])
             else:
-                lines.append(f'    return "__end__"')
-            lines.append("")
-            lines.append("")
-
-    return lines
+                append(_ROUTE_RETURN_END_BLOCK)
@@ -1,20 +1,33 @@
 """AJML Error Catalogue — compilation errors, warnings, and runtime errors."""
 
+from types import MappingProxyType
+
+
+def _format_detail(kind: str, code: str, message: str, filename: str, line: int) -> str:
+    """Render a diagnostic as `kind [code]: message` plus its file/line location."""
+    detail = f"{kind} [{code}]: {message}"
+    if filename:
+        detail += f"\n  → File: {filename}"
+        if line:
+            detail += f", Line: {line}"
+    return detail
+
 
 class AJMLCompilationError(Exception):
-    """Raised when AJML compilation fails validation."""
+    """Raised when AJML compilation fails validation.
+
+    The detail string is only rendered when the error is printed.
+    """
 
     def __init__(self, code: str, message: str, filename: str = "", line: int = 0):
         self.code = code
         self.message = message
         self.filename = filename
         self.line = line
-        detail = f"AJMLCompilationError [{code}]: {message}"
-        if filename:
-            detail += f"\n  → File: {filename}"
-            if line:
-                detail += f", Line: {line}"
-        super().__init__(detail)
+        super().__init__(code, message, filename, line)
+
+    def __str__(self):
+        return _format_detail("AJMLCompilationError", self.code, self.message, self.filename, self.line)
 
 
 class AJMLWarning:
@@ -27,12 +40,7 @@ class AJMLWarning:
         self.line = line
 
     def __str__(self):
-        detail = f"AJMLWarning [{self.code}]: {self.message}"
-        if self.filename:
-            detail += f"\n  → File: {self.filename}"
-            if self.line:
-                detail += f", Line: {self.line}"
-        return detail
+        return _format_detail("AJMLWarning", self.code, self.message, self.filename, self.line)
 
 
 # --- Error code constants ---
@@ -114,19 +122,19 @@ VALID_PARAM_TYPES = frozenset({
 # All valid types
 VALID_TYPES = VALID_SIMPLE_TYPES | VALID_PARAM_TYPES
 
-# Valid reducers by type
-VALID_REDUCERS = {
-    "string": {"overwrite", "concat"},
-    "int": {"overwrite", "add"},
-    "float": {"overwrite", "add"},
-    "bool": {"overwrite"},
-    "list": {"overwrite", "append"},
-    "dict": {"overwrite", "merge"},
-    "enum": {"overwrite"},
-}
+# Valid reducers by type (read-only, like the frozensets above)
+VALID_REDUCERS = MappingProxyType({
+    "string": frozenset({"overwrite", "concat"}),
+    "int": frozenset({"overwrite", "add"}),
+    "float": frozenset({"overwrite", "add"}),
+    "bool": frozenset({"overwrite"}),
+    "list": frozenset({"overwrite", "append"}),
+    "dict": frozenset({"overwrite", "merge"}),
+    "enum": frozenset({"overwrite"}),
+})
 
 # Parameterised types map to their base type for reducer validation
-PARAM_TYPE_BASE = {
+PARAM_TYPE_BASE = MappingProxyType({
     "list[string]": "list",
     "list[int]": "list",
     "list[float]": "list",
@@ -134,7 +142,13 @@ PARAM_TYPE_BASE = {
     "dict[string]": "dict",
     "dict[int]": "dict",
     "dict[any]": "dict",
-}
+})
+
+# Every valid type mapped straight to its allowed reducers
+TYPE_REDUCERS = MappingProxyType({
+    **{t: VALID_REDUCERS[t] for t in VALID_SIMPLE_TYPES},
+    **{t: VALID_REDUCERS[base] for t, base in PARAM_TYPE_BASE.items()},
+})
 
 # Supported LLM providers
 SUPPORTED_PROVIDERS = frozenset({
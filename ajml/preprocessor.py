@@ -3,37 +3,102 @@
 Sanitises .ajml files so they can be parsed by xml.etree.ElementTree.
 Handles <condition> and <system_prompt> content that may contain
 characters invalid in strict XML (comparison operators, angle brackets, etc.).
+
+Parsing deliberately stays on the stdlib ElementTree (backed by the C
+accelerator and expat): downstream phases rely on its comment-free trees
+and `ET.ParseError`, and the transpiler has no runtime dependencies.
 """
 
+import copy
+import hashlib
 import re
 import xml.etree.ElementTree as ET
 
+# Bare & that isn't already an escaped entity, and < that doesn't open a closing tag
+_BARE_AMP_RE = re.compile(r"&(?!amp;|lt;|gt;|apos;|quot;|#)")
+_OPEN_LT_RE = re.compile(r"<(?!/)")
+# Any character that makes a block need escaping; most blocks contain none
+_NEEDS_ESCAPE_RE = re.compile(r"[<>&]")
+
+# Tags whose content is sanitised before parsing; conditions come first
+_ESCAPE_TAGS = (
+    ("<condition>", "</condition>"),
+    ("<system_prompt>", "</system_prompt>"),
+)
+_CONDITION_RE = re.compile(r"<condition>(.*?)</condition>", re.DOTALL)
+
+# Entities introduced by _escape_content, restored in a single pass
+_UNESCAPE_RE = re.compile(r"&(lt|gt|amp);")
+_UNESCAPE_MAP = {"lt": "<", "gt": ">", "amp": "&"}
+
+# Parsed results keyed by a digest of the raw text, least recently used first
+_PREPROCESS_CACHE_SIZE = 256
+_preprocess_cache: dict[bytes, tuple[ET.Element, int]] = {}
+
 
 def _escape_content(text: str) -> str:
     """Escape XML-invalid characters in condition/prompt content."""
+    # Each rule only runs when its character is present, which is the rare case
     # Replace bare & that aren't already escaped entities
-    text = re.sub(r"&(?!amp;|lt;|gt;|apos;|quot;|#)", "&amp;", text)
+    if "&" in text:
+        text = _BARE_AMP_RE.sub("&amp;", text)
     # Replace < but not </ (closing tags)
-    text = re.sub(r"<(?!/)", "&lt;", text)
+    if "<" in text:
+        text = _OPEN_LT_RE.sub("&lt;", text)
     # Replace >
-    text = text.replace(">", "&gt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
     return text
 
 
-def _process_tag_content(raw: str, tag_name: str) -> str:
-    """Find all occurrences of <tag_name>...</tag_name> and escape their content."""
-    pattern = re.compile(
-        rf"(<{tag_name}>)(.*?)(</{tag_name}>)",
-        re.DOTALL,
-    )
+def _escape_tag_contents(raw: str) -> tuple[str, int]:
+    """Escape the content of every <condition> and <system_prompt> block in one pass.
 
-    def replacer(match):
-        open_tag = match.group(1)
-        content = match.group(2)
-        close_tag = match.group(3)
-        return open_tag + _escape_content(content) + close_tag
+    Blocks are located with str.find, and only the text up to a block that
+    actually needs escaping is copied; clean sources come back unchanged.
 
-    return pattern.sub(replacer, raw)
+    Returns:
+        Tuple of (processed text, number of conditions containing `<`, `>` or `&`).
+    """
+    opens = [raw.find(open_tag) for open_tag, _ in _ESCAPE_TAGS]
+    if max(opens) < 0:
+        # No <condition> or <system_prompt> at all: the text is already parseable
+        return raw, 0
+
+    out: list[str] = []
+    sanitised = 0
+    copied = 0  # raw[:copied] is already in out
+
+    while True:
+        pending = [(at, i) for i, at in enumerate(opens) if at >= 0]
+        if not pending:
+            break
+        start, i = min(pending)
+        open_tag, close_tag = _ESCAPE_TAGS[i]
+        body_start = start + len(open_tag)
+        end = raw.find(close_tag, body_start)
+        if end < 0:
+            # No later block of this tag can be closed either
+            opens[i] = -1
+            continue
+
+        content = raw[body_start:end]
+        if _NEEDS_ESCAPE_RE.search(content) is not None:
+            if i == 0:
+                sanitised += 1
+            out.append(raw[copied:body_start])
+            out.append(_escape_content(content))
+            copied = end
+
+        after = end + len(close_tag)
+        for j, at in enumerate(opens):
+            if 0 <= at < after:
+                opens[j] = raw.find(_ESCAPE_TAGS[j][0], after)
+
+    if not out:
+        return raw, 0
+    out.append(raw[copied:])
+    return "".join(out), sanitised
 
 
 def preprocess(raw_text: str) -> ET.Element:
@@ -43,16 +108,47 @@ def preprocess(raw_text: str) -> ET.Element:
     1. Escape content within <condition> and <system_prompt> tags.
     2. Parse with xml.etree.ElementTree.
 
+    Unchanged text is served from the same cache as `preprocess_with_stats`,
+    but the cached root is never handed out: every call returns a private
+    deep copy that the caller owns and may mutate freely. Use
+    `preprocess_with_stats` for the shared, read-only root.
+
     Returns:
-        ET.Element: The parsed root element.
+        ET.Element: A private copy of the parsed root element.
 
     Raises:
         ET.ParseError: If the sanitised text still fails to parse.
     """
-    sanitised = raw_text
-    sanitised = _process_tag_content(sanitised, "condition")
-    sanitised = _process_tag_content(sanitised, "system_prompt")
-    return ET.fromstring(sanitised)
+    return copy.deepcopy(preprocess_with_stats(raw_text)[0])
+
+
+def preprocess_with_stats(raw_text: str) -> tuple[ET.Element, int]:
+    """Pre-process raw AJML text, also counting the conditions that needed sanitisation.
+
+    Like calling `preprocess` and `count_sanitised_conditions`, but the
+    count is taken during the same pass that escapes the conditions.
+
+    Results are cached by content, so unchanged text is returned the same
+    shared root element rather than a copy; callers must treat it as
+    read-only.
+
+    Returns:
+        Tuple of (parsed root element, number of sanitised conditions).
+    """
+    key = hashlib.blake2b(raw_text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    cached = _preprocess_cache.pop(key, None)
+    if cached is None:
+        sanitised, conditions_sanitised = _escape_tag_contents(raw_text)
+        cached = ET.fromstring(sanitised), conditions_sanitised
+        if len(_preprocess_cache) >= _PREPROCESS_CACHE_SIZE:
+            del _preprocess_cache[next(iter(_preprocess_cache))]
+    _preprocess_cache[key] = cached
+    return cached
+
+
+def _unescape_entity(match: re.Match) -> str:
+    """Map an `&lt;`/`&gt;`/`&amp;` match back to its character."""
+    return _UNESCAPE_MAP[match.group(1)]
 
 
 def unescape_content(text: str) -> str:
@@ -61,18 +157,18 @@ def unescape_content(text: str) -> str:
     Used during code generation to restore original characters
     in condition expressions and system prompts.
     """
-    text = text.replace("&lt;", "<")
-    text = text.replace("&gt;", ">")
-    text = text.replace("&amp;", "&")
-    return text
+    if "&" not in text:
+        return text
+    return _UNESCAPE_RE.sub(_unescape_entity, text)
 
 
 def count_sanitised_conditions(raw_text: str) -> int:
     """Count how many <condition> blocks needed sanitisation."""
-    pattern = re.compile(r"<condition>(.*?)</condition>", re.DOTALL)
+    if "<condition>" not in raw_text:
+        return 0
     count = 0
-    for match in pattern.finditer(raw_text):
+    for match in _CONDITION_RE.finditer(raw_text):
         content = match.group(1)
-        if "<" in content or ">" in content or "&" in content:
+        if _NEEDS_ESCAPE_RE.search(content):
             count += 1
     return count
@@ -4,21 +4,21 @@ Validates parsed AJML ElementTree against structural and semantic rules.
 """
 
 import ast
+import functools
 import os
 import re
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, deque
+from sys import intern
 from typing import Any
 
 from .errors import (
     CONDITION_ALLOWED_NAMES,
-    PARAM_TYPE_BASE,
     RESERVED_WORDS,
     SUPPORTED_PROVIDERS,
+    TYPE_REDUCERS,
     VALID_NODE_TYPES,
-    VALID_REDUCERS,
     VALID_TOOL_TYPES,
-    VALID_TYPES,
     AJMLCompilationError,
     AJMLWarning,
     E001, E002, E003, E004,
@@ -33,20 +33,27 @@ from .errors import (
 )
 from .preprocessor import unescape_content
 
+# Field-name rule and ${field} prompt references
+_IDENTIFIER_RE = re.compile(r"[a-z_][a-z0-9_]*\Z")
+_INTERP_RE = re.compile(r"\$\{(\w+)\}")
 
-def _base_type(type_str: str) -> str:
-    """Get the base type for reducer validation."""
-    return PARAM_TYPE_BASE.get(type_str, type_str)
+# Allowed-value lists quoted in error messages
+_SUPPORTED_PROVIDERS_MSG = ", ".join(sorted(SUPPORTED_PROVIDERS))
+_VALID_TOOL_TYPES_MSG = ", ".join(sorted(VALID_TOOL_TYPES))
+_VALID_NODE_TYPES_MSG = ", ".join(sorted(VALID_NODE_TYPES))
+_VALID_REDUCERS_MSG = {t: ", ".join(sorted(rs)) for t, rs in TYPE_REDUCERS.items()}
 
-
-def _is_list_type(type_str: str) -> bool:
-    """Check if a type is a list type."""
-    return type_str == "list" or type_str.startswith("list[")
+# Outgoing-edge kinds, OR-ed together per source for the mixing rules
+_EDGE_CONDITION = 1
+_EDGE_DEFAULT = 2
+_EDGE_MAP = 4
+_EDGE_PLAIN = 8
+_EDGE_CONDITIONAL = _EDGE_CONDITION | _EDGE_DEFAULT
 
 
 def _is_valid_python_identifier(name: str) -> bool:
     """Check if a name is a valid Python identifier matching [a-z_][a-z0-9_]*."""
-    return bool(re.match(r"^[a-z_][a-z0-9_]*$", name))
+    return _IDENTIFIER_RE.match(name) is not None
 
 
 class AgentAST:
@@ -66,6 +73,19 @@ class AgentAST:
         self.nodes: list[dict[str, Any]] = []
         self.edges: list[dict[str, Any]] = []
 
+    @functools.cached_property
+    def field_name_set(self) -> frozenset[str]:
+        """Names of the declared state fields (read once validation is complete)."""
+        return frozenset(f["name"] for f in self.state_fields)
+
+    @functools.cached_property
+    def subgraph_refs(self) -> tuple[str, ...]:
+        """Agent referenced by each subgraph node, in node order.
+
+        Like `field_name_set`, only read once validation is complete.
+        """
+        return tuple(n["agent_ref"] for n in self.nodes if n["type"] == "subgraph")
+
 
 class ProjectAST:
     """Parsed representation of the _project.ajml file."""
@@ -133,7 +153,7 @@ def validate_project(root: ET.Element, filename: str) -> ProjectAST:
                 raise AJMLCompilationError(
                     E401,
                     f"Unknown LLM provider `{project.llm_provider}`. "
-                    f"Must be one of: {', '.join(sorted(SUPPORTED_PROVIDERS))}.",
+                    f"Must be one of: {_SUPPORTED_PROVIDERS_MSG}.",
                     filename,
                 )
 
@@ -219,7 +239,7 @@ def validate_agent(
                 raise AJMLCompilationError(
                     E401,
                     f"Unknown LLM provider `{provider}`. "
-                    f"Must be one of: {', '.join(sorted(SUPPORTED_PROVIDERS))}.",
+                    f"Must be one of: {_SUPPORTED_PROVIDERS_MSG}.",
                     filename,
                 )
             agent.config["llm_provider"] = provider
@@ -230,10 +250,10 @@ def validate_agent(
     field_names: set[str] = set()
     for field_elem in state_elem.findall("field"):
         name = field_elem.get("name", "")
-        type_str = field_elem.get("type", "")
+        type_str = intern(field_elem.get("type", ""))
         required = field_elem.get("required", "false").lower() == "true"
         default = field_elem.get("default")
-        reducer = field_elem.get("reducer", "overwrite")
+        reducer = intern(field_elem.get("reducer", "overwrite"))
         expose = field_elem.get("expose", "true").lower() == "true"
         values = field_elem.get("values", "")
 
@@ -261,8 +281,9 @@ def validate_agent(
             )
         field_names.add(name)
 
-        # Type validity
-        if type_str not in VALID_TYPES:
+        # Type validity (one lookup also yields the allowed reducers)
+        valid_reducers = TYPE_REDUCERS.get(type_str)
+        if valid_reducers is None:
             raise AJMLCompilationError(
                 E107,
                 f"Invalid state field type `{type_str}`. "
@@ -279,13 +300,11 @@ def validate_agent(
             )
 
         # Reducer validity
-        base = _base_type(type_str)
-        valid_reducers = VALID_REDUCERS.get(base, {"overwrite"})
         if reducer not in valid_reducers:
             raise AJMLCompilationError(
                 E108,
                 f"Reducer `{reducer}` is not valid for type `{type_str}`. "
-                f"Valid reducers: {', '.join(sorted(valid_reducers))}.",
+                f"Valid reducers: {_VALID_REDUCERS_MSG[type_str]}.",
                 filename,
             )
 
@@ -317,13 +336,15 @@ def validate_agent(
             "values": values,
         })
 
+    field_type_by_name = {f["name"]: f["type"] for f in agent.state_fields}
+
     # --- Validate tools ---
     tools_elem = root.find("tools")
     tool_ids: set[str] = set()
     if tools_elem is not None:
         for tool_elem in tools_elem.findall("tool"):
             tool_id = tool_elem.get("id", "")
-            tool_type = tool_elem.get("type", "")
+            tool_type = intern(tool_elem.get("type", ""))
 
             if tool_id in RESERVED_WORDS:
                 raise AJMLCompilationError(
@@ -344,7 +365,7 @@ def validate_agent(
                 raise AJMLCompilationError(
                     E106,
                     f"Invalid tool type `{tool_type}`. "
-                    f"Must be one of: {', '.join(sorted(VALID_TOOL_TYPES))}.",
+                    f"Must be one of: {_VALID_TOOL_TYPES_MSG}.",
                     filename,
                 )
 
@@ -393,8 +414,11 @@ def validate_agent(
     # --- Validate nodes ---
     node_ids: set[str] = set()
     for node_elem in graph_elem.findall("node"):
-        node_id = node_elem.get("id", "")
-        node_type = node_elem.get("type", "")
+        # Node IDs, edge endpoints and the type/reducer keywords are interned:
+        # every later set/dict probe and equality test on them (here and in
+        # codegen) is then an identity hit, and repeats share one string
+        node_id = intern(node_elem.get("id", ""))
+        node_type = intern(node_elem.get("type", ""))
 
         if node_id in RESERVED_WORDS:
             raise AJMLCompilationError(
@@ -415,7 +439,7 @@ def validate_agent(
             raise AJMLCompilationError(
                 E105,
                 f"Invalid node type `{node_type}`. "
-                f"Must be one of: {', '.join(sorted(VALID_NODE_TYPES))}.",
+                f"Must be one of: {_VALID_NODE_TYPES_MSG}.",
                 filename,
             )
 
@@ -471,13 +495,15 @@ def validate_agent(
 
     # --- Validate edges ---
     edge_sources: dict[str, list[dict[str, Any]]] = defaultdict(list)
+    edge_kinds: dict[str, int] = defaultdict(int)
+    default_counts: dict[str, int] = defaultdict(int)
     has_start_edge = False
 
     for edge_elem in graph_elem.findall("edge"):
-        source = edge_elem.get("source", "")
-        target = edge_elem.get("target", "")
+        source = intern(edge_elem.get("source", ""))
+        target = intern(edge_elem.get("target", ""))
         default = edge_elem.get("default", "false").lower() == "true"
-        edge_type = edge_elem.get("type", "")
+        edge_type = intern(edge_elem.get("type", ""))
 
         # Validate source
         if source == "__START__":
@@ -517,12 +543,10 @@ def validate_agent(
                 items_field = mc_elem.get("items_field", "")
                 item_var = mc_elem.get("item_var", "")
                 # Validate items_field references a list type
-                field_type = None
-                for f in agent.state_fields:
-                    if f["name"] == items_field:
-                        field_type = f["type"]
-                        break
-                if field_type is not None and not _is_list_type(field_type):
+                field_type = field_type_by_name.get(items_field)
+                if field_type is not None and not (
+                    field_type == "list" or field_type.startswith("list[")
+                ):
                     raise AJMLCompilationError(
                         E315,
                         f"Map edge `items_field` `{items_field}` must reference a list-type state field.",
@@ -542,6 +566,16 @@ def validate_agent(
         edge_sources[source].append(edge_data)
         agent.edges.append(edge_data)
 
+        kind = _EDGE_MAP if edge_type == "map" else 0
+        if condition_text:
+            kind |= _EDGE_CONDITION
+        elif default:
+            kind |= _EDGE_DEFAULT
+            default_counts[source] += 1
+        elif not edge_type:
+            kind |= _EDGE_PLAIN
+        edge_kinds[source] |= kind
+
     # Must have __START__ edge
     if not has_start_edge:
         raise AJMLCompilationError(
@@ -551,24 +585,17 @@ def validate_agent(
         )
 
     # Validate edge groups (mixing rules)
-    for source, edges in edge_sources.items():
-        has_conditions = any(e["condition"] for e in edges)
-        has_defaults = any(e["default"] for e in edges)
-        has_map = any(e["type"] == "map" for e in edges)
-        has_plain = any(
-            not e["condition"] and not e["default"] and not e["type"]
-            for e in edges
-        )
-
-        categories = []
-        if has_conditions or has_defaults:
-            categories.append("conditional")
-        if has_map:
-            categories.append("map")
-        if has_plain and not has_conditions and not has_defaults:
-            categories.append("unconditional")
-
-        if len(categories) > 1:
+    for source, kinds in edge_kinds.items():
+        conditional = kinds & _EDGE_CONDITIONAL
+        categories = 0
+        if conditional:
+            categories += 1
+        if kinds & _EDGE_MAP:
+            categories += 1
+        if kinds & _EDGE_PLAIN and not conditional:
+            categories += 1
+
+        if categories > 1:
             raise AJMLCompilationError(
                 E314,
                 f"Mixed edge types from source `{source}`. "
@@ -578,15 +605,15 @@ def validate_agent(
             )
 
         # Conditional group must have exactly one default
-        if has_conditions:
-            defaults = [e for e in edges if e["default"]]
-            if len(defaults) == 0:
+        if kinds & _EDGE_CONDITION:
+            defaults = default_counts[source]
+            if defaults == 0:
                 raise AJMLCompilationError(
                     E304,
                     f"Conditional edge group from `{source}` is missing a `default=\"true\"` edge.",
                     filename,
                 )
-            if len(defaults) > 1:
+            if defaults > 1:
                 raise AJMLCompilationError(
                     E306,
                     f"Multiple `default=\"true\"` edges from source `{source}`.",
@@ -599,13 +626,13 @@ def validate_agent(
             _validate_condition_expression(edge["condition"], filename)
 
     # Check node reachability
-    _check_reachability(agent, filename)
+    _check_reachability(agent, filename, edge_sources)
 
     # Check for nodes without outgoing edges (except __END__ targets)
-    _check_outgoing_edges(agent, filename)
+    _check_outgoing_edges(agent, filename, edge_sources)
 
     # Check parallel write warnings
-    warnings.extend(_check_parallel_writes(agent, filename))
+    warnings.extend(_check_parallel_writes(agent, filename, edge_sources))
 
     # Check for state fields never referenced in any LLM prompt or output_schema
     warnings.extend(_check_unreferenced_fields(agent, filename))
@@ -725,10 +752,24 @@ def _parse_llm_node(
     return data
 
 
+@functools.lru_cache(maxsize=512)
+def _disallowed_condition_name(expr: str) -> str | None:
+    """Return the first name in `expr` outside CONDITION_ALLOWED_NAMES, if any.
+
+    Cached per expression, since the same condition often guards several
+    edges or agents. Raises SyntaxError for invalid Python (not cached).
+    """
+    tree = ast.parse(expr, mode="eval")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in CONDITION_ALLOWED_NAMES:
+            return node.id
+    return None
+
+
 def _validate_condition_expression(expr: str, filename: str):
     """Validate a condition expression only uses allowed names."""
     try:
-        tree = ast.parse(expr, mode="eval")
+        name = _disallowed_condition_name(expr)
     except SyntaxError:
         raise AJMLCompilationError(
             E501,
@@ -736,32 +777,42 @@ def _validate_condition_expression(expr: str, filename: str):
             filename,
         )
 
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Name):
-            if node.id not in CONDITION_ALLOWED_NAMES:
-                raise AJMLCompilationError(
-                    E501,
-                    f"Condition expression references undefined name `{node.id}`. "
-                    "Only `state` and allowed builtins are available.",
-                    filename,
-                )
+    if name is not None:
+        raise AJMLCompilationError(
+            E501,
+            f"Condition expression references undefined name `{name}`. "
+            "Only `state` and allowed builtins are available.",
+            filename,
+        )
 
 
-def _check_reachability(agent: AgentAST, filename: str):
-    """Check all nodes are reachable from __START__."""
+def _check_reachability(
+    agent: AgentAST,
+    filename: str,
+    edge_sources: dict[str, list[dict[str, Any]]],
+):
+    """Check all nodes are reachable from __START__.
+
+    `edge_sources` maps each source to its outgoing edges, as grouped while
+    the edges were validated.
+    """
     reachable: set[str] = set()
-    queue = ["__START__"]
+    queue = deque(["__START__"])
 
     while queue:
-        current = queue.pop(0)
-        for edge in agent.edges:
-            if edge["source"] == current and edge["target"] not in reachable:
-                if edge["target"] != "__END__":
-                    reachable.add(edge["target"])
-                    queue.append(edge["target"])
-
-    node_ids = {n["id"] for n in agent.nodes}
-    unreachable = node_ids - reachable
+        current = queue.popleft()
+        for edge in edge_sources.get(current, ()):
+            target = edge["target"]
+            if target not in reachable and target != "__END__":
+                reachable.add(target)
+                queue.append(target)
+
+    # Edge targets are already known to be declared nodes, so a full count
+    # means nothing was missed
+    if len(reachable) == len(agent.nodes):
+        return
+
+    unreachable = {n["id"] for n in agent.nodes} - reachable
     for node_id in unreachable:
         raise AJMLCompilationError(
             E312,
@@ -770,11 +821,14 @@ def _check_reachability(agent: AgentAST, filename: str):
         )
 
 
-def _check_outgoing_edges(agent: AgentAST, filename: str):
+def _check_outgoing_edges(
+    agent: AgentAST,
+    filename: str,
+    edge_sources: dict[str, list[dict[str, Any]]],
+):
     """Check all nodes have at least one outgoing edge."""
-    sources = {e["source"] for e in agent.edges}
     for node in agent.nodes:
-        if node["id"] not in sources:
+        if node["id"] not in edge_sources:
             raise AJMLCompilationError(
                 E313,
                 f"Node `{node['id']}` has no outgoing edges.",
@@ -782,34 +836,38 @@ def _check_outgoing_edges(agent: AgentAST, filename: str):
             )
 
 
-def _check_parallel_writes(agent: AgentAST, filename: str) -> list[AJMLWarning]:
+def _check_parallel_writes(
+    agent: AgentAST,
+    filename: str,
+    edge_sources: dict[str, list[dict[str, Any]]],
+) -> list[AJMLWarning]:
     """Check for parallel branches that may write to the same overwrite field."""
+    # Simplified: every overwrite field is at risk on a fan-out, so there is
+    # nothing to warn about without any
+    overwrite_fields = [
+        f["name"] for f in agent.state_fields
+        if f["reducer"] == "overwrite"
+    ]
+    if not overwrite_fields:
+        return []
+
     warnings = []
-    edge_groups: dict[str, list[dict]] = defaultdict(list)
-    for e in agent.edges:
-        edge_groups[e["source"]].append(e)
 
     # Find parallel fan-out sources (multiple unconditional edges from same source)
-    for source, edges in edge_groups.items():
-        if len(edges) > 1 and all(
-            not e["condition"] and not e["default"] and not e["type"]
-            for e in edges
-        ):
-            # These are parallel branches - check if they write to same overwrite fields
-            # Simplified: warn about any overwrite fields in state
-            overwrite_fields = [
-                f["name"] for f in agent.state_fields
-                if f["reducer"] == "overwrite"
-            ]
-            if overwrite_fields:
-                for field_name in overwrite_fields:
-                    warnings.append(AJMLWarning(
-                        W301,
-                        f"Parallel branches from `{source}` may both write to "
-                        f"field `{field_name}` which uses the `overwrite` reducer. "
-                        "Result may be non-deterministic.",
-                        filename,
-                    ))
+    for source, edges in edge_sources.items():
+        if len(edges) < 2:
+            continue
+        if all(not e["condition"] and not e["default"] and not e["type"] for e in edges):
+            warnings.extend([
+                AJMLWarning(
+                    W301,
+                    f"Parallel branches from `{source}` may both write to "
+                    f"field `{field_name}` which uses the `overwrite` reducer. "
+                    "Result may be non-deterministic.",
+                    filename,
+                )
+                for field_name in overwrite_fields
+            ])
 
     return warnings
 
@@ -823,7 +881,7 @@ def _check_unreferenced_fields(agent: AgentAST, filename: str) -> list[AJMLWarni
     for node in agent.nodes:
         if node["type"] == "llm":
             prompt = node.get("system_prompt", "")
-            referenced.update(re.findall(r"\$\{(\w+)\}", prompt))
+            referenced.update(_INTERP_RE.findall(prompt))
             for field in node.get("output_schema", []):
                 referenced.add(field["name"])
 
@@ -856,8 +914,7 @@ def _validate_subgraph_refs(
                     filename,
                 )
 
-            child = all_agents[agent_ref]
-            child_fields = {f["name"] for f in child.state_fields}
+            child_fields = all_agents[agent_ref].field_name_set
 
             for mapping in node.get("input_map", []):
                 if mapping["target"] not in child_fields:
@@ -878,57 +935,114 @@ def _validate_subgraph_refs(
                     )
 
 
+def check_project_agents(agents: dict[str, AgentAST]):
+    """Run every cross-agent check in one walk over the agents.
+
+    Equivalent to `check_duplicate_agent_names`, `check_circular_dependencies`
+    and `check_subgraph_references` in that order, with the name set and the
+    dependency graph built together.
+    """
+    names: set[str] = set()
+    deps: dict[str, set[str]] = {}
+    parents: dict[str, list[str]] = {name: [] for name in agents}
+    has_subgraphs = False
+    for name, agent in agents.items():
+        names.add(agent.name)
+        refs = set(agent.subgraph_refs)
+        deps[name] = refs
+        if refs:
+            has_subgraphs = True
+            for ref in refs:
+                if ref in parents:
+                    parents[ref].append(name)
+
+    if len(names) != len(agents):
+        check_duplicate_agent_names(agents)
+    if has_subgraphs:
+        _check_acyclic(deps, parents, "")
+        check_subgraph_references(agents)
+
+
+def check_subgraph_references(agents: dict[str, AgentAST]):
+    """Check every subgraph node against the complete set of project agents."""
+    for agent in agents.values():
+        _validate_subgraph_refs(agent, agents, agent.filename)
+
+
 def check_circular_dependencies(
     agents: dict[str, AgentAST],
     filename: str = "",
 ):
-    """Check for circular subgraph dependencies across all agents."""
-    # Build dependency graph
+    """Check for circular subgraph dependencies across all agents.
+
+    Runs Kahn's topological sort over the subgraph references; any agent left
+    unprocessed sits on, or is embedded below, a cycle.
+    """
+    # Build dependency graph, plus the agents embedding each one
     deps: dict[str, set[str]] = {}
+    parents: dict[str, list[str]] = {name: [] for name in agents}
     for name, agent in agents.items():
-        deps[name] = set()
-        for node in agent.nodes:
-            if node["type"] == "subgraph":
-                deps[name].add(node["agent_ref"])
-
-    # DFS cycle detection
-    visited: set[str] = set()
-    in_stack: set[str] = set()
-    path: list[str] = []
+        refs = set(agent.subgraph_refs)
+        deps[name] = refs
+        for ref in refs:
+            # References to unknown agents are reported separately (E309)
+            if ref in parents:
+                parents[ref].append(name)
 
-    def dfs(node: str) -> bool:
-        visited.add(node)
-        in_stack.add(node)
-        path.append(node)
+    _check_acyclic(deps, parents, filename)
 
-        for dep in deps.get(node, set()):
-            if dep in in_stack:
-                cycle = path[path.index(dep):] + [dep]
-                raise AJMLCompilationError(
-                    E402,
-                    f"Circular subgraph dependency detected: {' → '.join(cycle)}.",
-                    filename,
-                )
-            if dep not in visited:
-                dfs(dep)
 
-        path.pop()
-        in_stack.remove(node)
-        return False
+def _check_acyclic(
+    deps: dict[str, set[str]],
+    parents: dict[str, list[str]],
+    filename: str,
+):
+    """Raise E402 if the agent dependency graph has a cycle (Kahn's algorithm)."""
+    in_degree = {name: len(p) for name, p in parents.items()}
+    queue = deque(name for name, degree in in_degree.items() if degree == 0)
+    processed = 0
+    while queue:
+        name = queue.popleft()
+        processed += 1
+        for ref in deps[name]:
+            if ref in in_degree:
+                in_degree[ref] -= 1
+                if in_degree[ref] == 0:
+                    queue.append(ref)
+
+    if processed == len(in_degree):
+        return
+
+    # Every leftover agent still has a leftover parent, so walking parents
+    # must revisit one; the stretch from that revisit is a cycle, reversed
+    node = next(name for name, degree in in_degree.items() if degree > 0)
+    path: list[str] = []
+    path_pos: dict[str, int] = {}
+    while node not in path_pos:
+        path_pos[node] = len(path)
+        path.append(node)
+        node = next(p for p in parents[node] if in_degree[p] > 0)
 
-    for name in agents:
-        if name not in visited:
-            dfs(name)
+    cycle = [node, *path[:path_pos[node]:-1], node]
+    raise AJMLCompilationError(
+        E402,
+        f"Circular subgraph dependency detected: {' → '.join(cycle)}.",
+        filename,
+    )
 
 
 def check_duplicate_agent_names(agents: dict[str, AgentAST]):
     """Check that no two agents share the same name."""
-    seen: dict[str, str] = {}
-    for name, agent in agents.items():
+    if len({agent.name for agent in agents.values()}) == len(agents):
+        return
+
+    # Rescan only to report the first repeat, at its second occurrence
+    seen: set[str] = set()
+    for agent in agents.values():
         if agent.name in seen:
             raise AJMLCompilationError(
                 E403,
                 f"Duplicate agent name `{agent.name}` across project.",
                 agent.filename,
             )
-        seen[agent.name] = agent.filename
+        seen.add(agent.name)
@@ -51,55 +51,61 @@ def _make_project_and_agent():
     return project, {"my_agent": agent}
 
 
+@pytest.fixture(scope="module")
+def project_and_agents():
+    """Shared read-only project and agent ASTs, built once per module."""
+    return _make_project_and_agent()
+
+
 class TestGenerateMainPy:
     """Test main.py generation."""
 
-    def test_contains_fastapi_app(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_fastapi_app(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert 'app = FastAPI(title="test_project")' in code
 
-    def test_contains_health_endpoint(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_health_endpoint(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert '@app.get("/health")' in code
         assert '{"status": "ok"}' in code
 
-    def test_contains_agent_endpoint(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_agent_endpoint(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert '@app.post("/run/my_agent"' in code
         assert "async def run_my_agent" in code
 
-    def test_contains_cors_middleware(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_cors_middleware(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert "CORSMiddleware" in code
         assert '"https://example.com"' in code
 
-    def test_contains_auth(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_auth(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert "verify_api_key" in code
         assert "X-API-Key" in code
         assert 'API_KEY = os.getenv("MY_API_KEY"' in code
 
-    def test_contains_request_model(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_request_model(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert "class MyAgentRequest(BaseModel):" in code
         assert "input_text: str" in code
 
-    def test_contains_response_model(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_response_model(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert "class MyAgentResponse(BaseModel):" in code
         assert "result" in code
         # internal field with expose=false should NOT be in response
         # (it's filtered out in endpoint logic)
 
-    def test_contains_settings(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_settings(self, project_and_agents):
+        project, agents = project_and_agents
         code = generate_main_py(project, agents)
         assert "class Settings(BaseSettings):" in code
         assert "OPENAI_API_KEY: str" in code
@@ -132,8 +138,8 @@ class TestGenerateMainPy:
 class TestGenerateRequirementsTxt:
     """Test requirements.txt generation."""
 
-    def test_core_packages(self):
-        project, agents = _make_project_and_agent()
+    def test_core_packages(self, project_and_agents):
+        project, agents = project_and_agents
         reqs = generate_requirements_txt(project, agents)
         assert "fastapi" in reqs
         assert "uvicorn" in reqs
@@ -141,17 +147,44 @@ class TestGenerateRequirementsTxt:
         assert "langgraph" in reqs
         assert "langchain-core" in reqs
 
-    def test_provider_package(self):
-        project, agents = _make_project_and_agent()
+    def test_provider_package(self, project_and_agents):
+        project, agents = project_and_agents
         reqs = generate_requirements_txt(project, agents)
         assert "langchain-openai" in reqs
 
+    def test_api_tool_packages(self, project_and_agents):
+        project, _ = project_and_agents
+        agent_raw = '''<?xml version="1.0"?>
+<agent name="fetcher">
+    <config><llm provider="anthropic" model="claude" /></config>
+    <state><field name="x" type="string" default="" /></state>
+    <tools>
+        <tool id="plain" type="api_call">
+            <endpoint url="https://example.com/plain" />
+        </tool>
+        <tool id="retried" type="api_call" max_retries="3">
+            <endpoint url="https://example.com/retried" />
+        </tool>
+    </tools>
+    <graph>
+        <node id="a" type="action" tool_ref="plain" />
+        <edge source="__START__" target="a" />
+        <edge source="a" target="__END__" />
+    </graph>
+</agent>'''
+        agent, _ = validate_agent(preprocess(agent_raw), "fetcher.ajml", project)
+        reqs = generate_requirements_txt(project, {"fetcher": agent})
+        assert "httpx>=" in reqs
+        assert "tenacity>=" in reqs
+        assert "langchain-anthropic" in reqs
+        assert "langchain-openai" in reqs
+
 
 class TestGenerateEnvExample:
     """Test .env.example generation."""
 
-    def test_contains_env_vars(self):
-        project, agents = _make_project_and_agent()
+    def test_contains_env_vars(self, project_and_agents):
+        project, agents = project_and_agents
         env = generate_env_example(project)
         assert "MY_API_KEY=your-api-key-here" in env
         assert "OPENAI_API_KEY=" in env
@@ -1,14 +1,27 @@
 """Tests for the AJML CLI commands."""
 
 import os
-import shutil
-import tempfile
-
-import pytest
 
 from ajml.cli import cmd_build, cmd_init
 
 
+# Minimal project and single-node agent shared by the build tests
+_PROJECT_AJML = '''<?xml version="1.0"?>
+<project name="test" ajml_version="2.0">
+    <config><llm provider="openai" model="gpt-4o" /></config>
+</project>'''
+
+_AGENT_AJML = '''<?xml version="1.0"?>
+<agent name="test">
+    <state><field name="x" type="string" default="" /></state>
+    <graph>
+        <node id="a" type="llm" />
+        <edge source="__START__" target="a" />
+        <edge source="a" target="__END__" />
+    </graph>
+</agent>'''
+
+
 class MockArgs:
     """Mock argparse namespace."""
     def __init__(self, **kwargs):
@@ -19,46 +32,46 @@ class MockArgs:
 class TestInitCommand:
     """Test the init command."""
 
-    def test_creates_project_structure(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            project_name = os.path.join(tmpdir, "my_project")
-            args = MockArgs(project_name=project_name)
-            result = cmd_init(args)
-            assert result == 0
+    def test_creates_project_structure(self, tmp_path):
+        tmpdir = str(tmp_path)
+        project_name = os.path.join(tmpdir, "my_project")
+        args = MockArgs(project_name=project_name)
+        result = cmd_init(args)
+        assert result == 0
 
-            assert os.path.exists(os.path.join(project_name, "agents", "_project.ajml"))
-            assert os.path.exists(os.path.join(project_name, "agents", "example_agent.ajml"))
-            assert os.path.exists(os.path.join(project_name, "tools", "example_tool.py"))
-            assert os.path.exists(os.path.join(project_name, ".env.example"))
-            assert os.path.exists(os.path.join(project_name, ".gitignore"))
-            assert os.path.isdir(os.path.join(project_name, "build"))
+        assert os.path.exists(os.path.join(project_name, "agents", "_project.ajml"))
+        assert os.path.exists(os.path.join(project_name, "agents", "example_agent.ajml"))
+        assert os.path.exists(os.path.join(project_name, "tools", "example_tool.py"))
+        assert os.path.exists(os.path.join(project_name, ".env.example"))
+        assert os.path.exists(os.path.join(project_name, ".gitignore"))
+        assert os.path.isdir(os.path.join(project_name, "build"))
 
-    def test_existing_directory_fails(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            args = MockArgs(project_name=tmpdir)
-            result = cmd_init(args)
-            assert result == 2
+    def test_existing_directory_fails(self, tmp_path):
+        tmpdir = str(tmp_path)
+        args = MockArgs(project_name=tmpdir)
+        result = cmd_init(args)
+        assert result == 2
 
 
 class TestBuildCommand:
     """Test the build command."""
 
-    def test_builds_simple_project(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Create project structure
-            agents_dir = os.path.join(tmpdir, "agents")
-            os.makedirs(agents_dir)
+    def test_builds_simple_project(self, tmp_path):
+        tmpdir = str(tmp_path)
+        # Create project structure
+        agents_dir = os.path.join(tmpdir, "agents")
+        os.makedirs(agents_dir)
 
-            project_ajml = '''<?xml version="1.0" encoding="UTF-8"?>
+        project_ajml = '''<?xml version="1.0" encoding="UTF-8"?>
 <project name="test" ajml_version="2.0">
     <config>
         <llm provider="openai" model="gpt-4o" />
     </config>
 </project>'''
-            with open(os.path.join(agents_dir, "_project.ajml"), "w") as f:
-                f.write(project_ajml)
+        with open(os.path.join(agents_dir, "_project.ajml"), "w") as f:
+            f.write(project_ajml)
 
-            agent_ajml = '''<?xml version="1.0" encoding="UTF-8"?>
+        agent_ajml = '''<?xml version="1.0" encoding="UTF-8"?>
 <agent name="simple_agent" version="1.0" description="A simple agent.">
     <state>
         <field name="input" type="string" required="true" />
@@ -75,89 +88,78 @@ class TestBuildCommand:
         <edge source="respond" target="__END__" />
     </graph>
 </agent>'''
-            with open(os.path.join(agents_dir, "simple_agent.ajml"), "w") as f:
-                f.write(agent_ajml)
-
-            args = MockArgs(
-                project_dir=tmpdir,
-                output="build",
-                verbose=True,
-                strict=False,
-                dry_run=False,
-            )
-            result = cmd_build(args)
-            assert result == 0
-
-            build_dir = os.path.join(tmpdir, "build")
-            assert os.path.exists(os.path.join(build_dir, "compiled_simple_agent.py"))
-            assert os.path.exists(os.path.join(build_dir, "main.py"))
-            assert os.path.exists(os.path.join(build_dir, "requirements.txt"))
-            assert os.path.exists(os.path.join(build_dir, ".env.example"))
-
-    def test_dry_run_no_files(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            agents_dir = os.path.join(tmpdir, "agents")
-            os.makedirs(agents_dir)
-
-            with open(os.path.join(agents_dir, "_project.ajml"), "w") as f:
-                f.write('''<?xml version="1.0"?>
-<project name="test" ajml_version="2.0">
-    <config><llm provider="openai" model="gpt-4o" /></config>
-</project>''')
-
-            with open(os.path.join(agents_dir, "test.ajml"), "w") as f:
-                f.write('''<?xml version="1.0"?>
-<agent name="test">
-    <state><field name="x" type="string" default="" /></state>
-    <graph>
-        <node id="a" type="llm" />
-        <edge source="__START__" target="a" />
-        <edge source="a" target="__END__" />
-    </graph>
-</agent>''')
-
-            args = MockArgs(
-                project_dir=tmpdir,
-                output="build",
-                verbose=False,
-                strict=False,
-                dry_run=True,
-            )
-            result = cmd_build(args)
-            assert result == 0
-
-            build_dir = os.path.join(tmpdir, "build")
-            assert not os.path.exists(build_dir)
-
-    def test_missing_project_file_fails(self):
-        with tempfile.TemporaryDirectory() as tmpdir:
-            os.makedirs(os.path.join(tmpdir, "agents"))
-            args = MockArgs(
-                project_dir=tmpdir,
-                output="build",
-                verbose=False,
-                strict=False,
-                dry_run=False,
-            )
-            result = cmd_build(args)
-            assert result == 1
-
-    def test_builds_intent_classifier_example(self):
+        with open(os.path.join(agents_dir, "simple_agent.ajml"), "w") as f:
+            f.write(agent_ajml)
+
+        args = MockArgs(
+            project_dir=tmpdir,
+            output="build",
+            verbose=True,
+            strict=False,
+            dry_run=False,
+        )
+        result = cmd_build(args)
+        assert result == 0
+
+        build_dir = os.path.join(tmpdir, "build")
+        assert os.path.exists(os.path.join(build_dir, "compiled_simple_agent.py"))
+        assert os.path.exists(os.path.join(build_dir, "main.py"))
+        assert os.path.exists(os.path.join(build_dir, "requirements.txt"))
+        assert os.path.exists(os.path.join(build_dir, ".env.example"))
+
+    def test_dry_run_no_files(self, tmp_path):
+        tmpdir = str(tmp_path)
+        agents_dir = os.path.join(tmpdir, "agents")
+        os.makedirs(agents_dir)
+
+        with open(os.path.join(agents_dir, "_project.ajml"), "w") as f:
+            f.write(_PROJECT_AJML)
+
+        with open(os.path.join(agents_dir, "test.ajml"), "w") as f:
+            f.write(_AGENT_AJML)
+
+        args = MockArgs(
+            project_dir=tmpdir,
+            output="build",
+            verbose=False,
+            strict=False,
+            dry_run=True,
+        )
+        result = cmd_build(args)
+        assert result == 0
+
+        build_dir = os.path.join(tmpdir, "build")
+        assert not os.path.exists(build_dir)
+
+    def test_missing_project_file_fails(self, tmp_path):
+        tmpdir = str(tmp_path)
+        os.makedirs(os.path.join(tmpdir, "agents"))
+        args = MockArgs(
+            project_dir=tmpdir,
+            output="build",
+            verbose=False,
+            strict=False,
+            dry_run=False,
+        )
+        result = cmd_build(args)
+        assert result == 1
+
+    def test_builds_intent_classifier_example(self, tmp_path):
         """Build the §16.1 example from the spec."""
-        with tempfile.TemporaryDirectory() as tmpdir:
-            agents_dir = os.path.join(tmpdir, "agents")
-            os.makedirs(agents_dir)
+        tmpdir = str(tmp_path)
+        agents_dir = os.path.join(tmpdir, "agents")
+        os.makedirs(agents_dir)
 
-            with open(os.path.join(agents_dir, "_project.ajml"), "w") as f:
-                f.write('''<?xml version="1.0" encoding="UTF-8"?>
+        with open(os.path.join(agents_dir, "_project.ajml"), "w") as f:
+            f.write('''<?xml version="1.0" encoding="UTF-8"?>
 <project name="classifier_demo" ajml_version="2.0">
     <config>
         <llm provider="openai" model="gpt-4o-mini" />
     </config>
 </project>''')
 
-            with open(os.path.join(agents_dir, "intent_classifier.ajml"), "w") as f:
-                f.write('''<?xml version="1.0" encoding="UTF-8"?>
+        with open(os.path.join(agents_dir, "intent_classifier.ajml"), "w") as f:
+            f.write('''<?xml version="1.0" encoding="UTF-8"?>
 <agent name="intent_classifier" version="1.0"
        description="Classifies customer messages into intent categories.">
 
@@ -187,27 +189,74 @@ class TestBuildCommand:
     </graph>
 </agent>''')
 
-            args = MockArgs(
-                project_dir=tmpdir,
-                output="build",
-                verbose=True,
-                strict=False,
-                dry_run=False,
-            )
-            result = cmd_build(args)
-            assert result == 0
-
-            build_dir = os.path.join(tmpdir, "build")
-            compiled_path = os.path.join(build_dir, "compiled_intent_classifier.py")
-            assert os.path.exists(compiled_path)
-
-            with open(compiled_path) as f:
-                code = f.read()
-
-            # Validate the compiled code is valid Python
-            compile(code, compiled_path, "exec")
-
-            assert "class AgentState(TypedDict):" in code
-            assert "class ClassifyOutput(BaseModel):" in code
-            assert "def classify(state: AgentState):" in code
-            assert "graph = graph_builder.compile()" in code
+        args = MockArgs(
+            project_dir=tmpdir,
+            output="build",
+            verbose=True,
+            strict=False,
+            dry_run=False,
+        )
+        result = cmd_build(args)
+        assert result == 0
+
+        build_dir = os.path.join(tmpdir, "build")
+        compiled_path = os.path.join(build_dir, "compiled_intent_classifier.py")
+        assert os.path.exists(compiled_path)
+
+        with open(compiled_path) as f:
+            code = f.read()
+
+        # Validate the compiled code is valid Python
+        compile(code, compiled_path, "exec")
+
+        assert "class AgentState(TypedDict):" in code
+        assert "class ClassifyOutput(BaseModel):" in code
+        assert "def classify(state: AgentState):" in code
+        assert "graph = graph_builder.compile()" in code
+
+    def test_rebuild_leaves_unchanged_outputs_untouched(self, tmp_path):
+        tmpdir = str(tmp_path)
+        agents_dir = os.path.join(tmpdir, "agents")
+        os.makedirs(agents_dir)
+
+        with open(os.path.join(agents_dir, "_project.ajml"), "w") as f:
+            f.write(_PROJECT_AJML)
+
+        agent_path = os.path.join(agents_dir, "test.ajml")
+        agent_ajml = _AGENT_AJML
+        with open(agent_path, "w") as f:
+            f.write(agent_ajml)
+
+        args = MockArgs(
+            project_dir=tmpdir,
+            output="build",
+            verbose=False,
+            strict=False,
+            dry_run=False,
+        )
+        compiled_path = os.path.join(tmpdir, "build", "compiled_test.py")
+        output_paths = [
+            os.path.join(tmpdir, "build", name)
+            for name in ("compiled_test.py", "main.py", "requirements.txt", ".env.example")
+        ]
+
+        assert cmd_build(args) == 0
+        with open(compiled_path) as f:
+            first = f.read()
+
+        # Backdate every output so a rewrite would show up as a new mtime
+        for path in output_paths:
+            os.utime(path, ns=(0, 0))
+        assert cmd_build(args) == 0
+        with open(compiled_path) as f:
+            assert f.read() == first
+        for path in output_paths:
+            assert os.stat(path).st_mtime_ns == 0, path
+
+        # Changing the agent source rewrites its compiled module
+        with open(agent_path, "w") as f:
+            f.write(agent_ajml.replace('id="a"', 'id="b"').replace('target="a"', 'target="b"').replace('source="a"', 'source="b"'))
+        assert cmd_build(args) == 0
+        with open(compiled_path) as f:
+            assert "def b(state: AgentState):" in f.read()
+        assert os.stat(compiled_path).st_mtime_ns != 0
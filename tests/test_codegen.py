@@ -18,10 +18,16 @@ def _make_project(provider="openai", model="gpt-4o"):
     return validate_project(root, "agents/_project.ajml")
 
 
+@pytest.fixture(scope="module")
+def project():
+    """Shared read-only default project AST, built once per module."""
+    return _make_project()
+
+
 class TestCodeGeneration:
     """Test Python code generation from AJML agents."""
 
-    def test_generates_state_typeddict(self):
+    def test_generates_state_typeddict(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -35,7 +41,6 @@ class TestCodeGeneration:
         <edge source="process" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
@@ -46,7 +51,7 @@ class TestCodeGeneration:
         assert "count: int" in code
         assert "items: Annotated[list, operator.add]" in code
 
-    def test_generates_llm_node_with_structured_output(self):
+    def test_generates_llm_node_with_structured_output(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -63,7 +68,6 @@ class TestCodeGeneration:
         <edge source="classify" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
@@ -72,8 +76,10 @@ class TestCodeGeneration:
         assert 'intent: str = Field(description="The intent")' in code
         assert "def classify(state: AgentState):" in code
         assert "structured_llm = llm.with_structured_output(ClassifyOutput)" in code
+        assert '_STATE_KEYS = frozenset({"messages", "intent"})' in code
+        assert "updates = {k: v for k, v in result_dict.items() if k in _STATE_KEYS}" in code
 
-    def test_generates_plain_llm_node(self):
+    def test_generates_plain_llm_node(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -87,15 +93,15 @@ class TestCodeGeneration:
         <edge source="chat" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
 
         assert "def chat(state: AgentState):" in code
         assert "response = llm.invoke(messages)" in code
+        assert "_STATE_KEYS" not in code
 
-    def test_generates_conditional_routing(self):
+    def test_generates_conditional_routing(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -114,7 +120,6 @@ class TestCodeGeneration:
         <edge source="no" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
@@ -124,7 +129,7 @@ class TestCodeGeneration:
         assert 'return "yes"' in code
         assert 'return "no"' in code
 
-    def test_generates_graph_assembly(self):
+    def test_generates_graph_assembly(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -138,7 +143,6 @@ class TestCodeGeneration:
         <edge source="b" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
@@ -149,8 +153,7 @@ class TestCodeGeneration:
         assert "graph_builder.add_edge(START, " in code
         assert "graph = graph_builder.compile()" in code
 
-    def test_generates_llm_init(self):
-        project = _make_project("openai", "gpt-4o")
+    def test_generates_llm_init(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state><field name="x" type="string" default="" /></state>
@@ -167,8 +170,7 @@ class TestCodeGeneration:
         assert 'llm = ChatOpenAI(model="gpt-4o", max_retries=2)' in code
         assert "from langchain_openai import ChatOpenAI" in code
 
-    def test_agent_override_provider(self):
-        project = _make_project("openai", "gpt-4o")
+    def test_agent_override_provider(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <config>
@@ -187,7 +189,7 @@ class TestCodeGeneration:
 
         assert 'llm = ChatAnthropic(model="claude-sonnet-4-20250514", max_retries=5)' in code
 
-    def test_generates_parallel_edges(self):
+    def test_generates_parallel_edges(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -205,7 +207,6 @@ class TestCodeGeneration:
         <edge source="merge" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
@@ -213,7 +214,7 @@ class TestCodeGeneration:
         assert 'graph_builder.add_edge(START, "task_a")' in code
         assert 'graph_builder.add_edge(START, "task_b")' in code
 
-    def test_generates_merge_reducer(self):
+    def test_generates_merge_reducer(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -225,14 +226,13 @@ class TestCodeGeneration:
         <edge source="a" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
 
         assert "data: Annotated[dict, lambda a, b: {**a, **b}]" in code
 
-    def test_generates_concat_reducer(self):
+    def test_generates_concat_reducer(self, project):
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
     <state>
@@ -244,14 +244,13 @@ class TestCodeGeneration:
         <edge source="a" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
 
         assert "log: Annotated[str, operator.concat]" in code
 
-    def test_generated_code_is_valid_python(self):
+    def test_generated_code_is_valid_python(self, project):
         """Verify generated code can be parsed as valid Python."""
         raw = '''<?xml version="1.0"?>
 <agent name="test_agent">
@@ -271,10 +270,82 @@ class TestCodeGeneration:
         <edge source="process" target="__END__" />
     </graph>
 </agent>'''
-        project = _make_project()
         root = preprocess(raw)
         agent, _ = validate_agent(root, "test.ajml", project)
         code = generate_agent_code(agent, project)
 
         # This should not raise
         compile(code, "<test>", "exec")
+
+    def test_api_tool_literals_only_interpolate_placeholders(self, project):
+        raw = '''<?xml version="1.0"?>
+<agent name="test_agent">
+    <state>
+        <field name="user_id" type="string" default="" />
+    </state>
+    <tools>
+        <tool id="fetch_user" type="api_call">
+            <endpoint url="https://api.example.com/users/${id}" method="GET" />
+            <headers>
+                <header name="Authorization" value="Bearer ${env:USER_API_TOKEN}" />
+                <header name="Accept" value="application/json" />
+            </headers>
+            <parameters>
+                <param name="user_id" type="string" map_to="id" in="path" />
+            </parameters>
+        </tool>
+        <tool id="ping" type="api_call">
+            <endpoint url="https://api.example.com/ping" method="GET" />
+        </tool>
+    </tools>
+    <graph>
+        <node id="fetch" type="action" tool_ref="fetch_user" />
+        <edge source="__START__" target="fetch" />
+        <edge source="fetch" target="__END__" />
+    </graph>
+</agent>'''
+        root = preprocess(raw)
+        agent, _ = validate_agent(root, "test.ajml", project)
+        code = generate_agent_code(agent, project)
+
+        assert 'url = f"https://api.example.com/users/{user_id}"' in code
+        assert 'url = "https://api.example.com/ping"' in code
+        assert '"Authorization": f"Bearer {os.getenv(\'USER_API_TOKEN\')}",' in code
+        assert '"Accept": "application/json",' in code
+        compile(code, "<test>", "exec")
+
+    def test_tool_loop_routers_are_plain_functions(self, project):
+        raw = '''<?xml version="1.0"?>
+<agent name="test_agent">
+    <state>
+        <field name="x" type="string" default="" />
+    </state>
+    <tools>
+        <tool id="ping" type="api_call">
+            <endpoint url="https://api.example.com/ping" method="GET" />
+        </tool>
+    </tools>
+    <graph>
+        <node id="research" type="llm">
+            <system_prompt>Research ${x}.</system_prompt>
+            <tool_bind ref="ping" />
+        </node>
+        <node id="review" type="llm">
+            <system_prompt>Review.</system_prompt>
+            <tool_bind ref="ping" />
+        </node>
+        <edge source="__START__" target="research" />
+        <edge source="research" target="review" />
+        <edge source="review" target="__END__" />
+    </graph>
+</agent>'''
+        root = preprocess(raw)
+        agent, _ = validate_agent(root, "test.ajml", project)
+        code = generate_agent_code(agent, project)
+
+        assert "def route_research(state: AgentState):" in code
+        assert '        return "research_tools"\n    return "review"\n' in code
+        assert "def route_review(state: AgentState):" in code
+        assert '        return "review_tools"\n    return "__end__"\n' in code
+        assert 'graph_builder.add_conditional_edges("research", route_research)' in code
+        compile(code, "<test>", "exec")
@@ -2,7 +2,13 @@
 
 import pytest
 
-from ajml.preprocessor import count_sanitised_conditions, preprocess, unescape_content
+from ajml.preprocessor import (
+    _escape_tag_contents,
+    count_sanitised_conditions,
+    preprocess,
+    preprocess_with_stats,
+    unescape_content,
+)
 
 
 class TestPreprocess:
@@ -99,6 +105,10 @@ class TestUnescapeContent:
     def test_plain_text_unchanged(self):
         assert unescape_content("hello world") == "hello world"
 
+    def test_escaped_entity_text_is_not_double_unescaped(self):
+        assert unescape_content("write &amp;lt; for <") == "write &lt; for <"
+        assert unescape_content("&amp;amp;") == "&amp;"
+
 
 class TestCountSanitisedConditions:
     """Test counting of conditions that needed sanitisation."""
@@ -121,3 +131,55 @@ class TestCountSanitisedConditions:
         <condition>state.get('z') == 0</condition>
         """
         assert count_sanitised_conditions(raw) == 2
+
+
+class TestPreprocessWithStats:
+    """Test the combined pre-process and sanitisation count."""
+
+    def test_matches_separate_count(self):
+        raw = '''<?xml version="1.0" encoding="UTF-8"?>
+<agent name="test" version="1.0">
+    <state>
+        <field name="x" type="int" default="0" />
+    </state>
+    <graph>
+        <node id="a" type="llm">
+            <system_prompt>Only flag when x > 5.</system_prompt>
+        </node>
+        <node id="b" type="llm" />
+        <edge source="a" target="b">
+            <condition>state.get('x') > 5</condition>
+        </edge>
+        <edge source="a" target="__END__">
+            <condition>state.get('x') == 0</condition>
+        </edge>
+        <edge source="__START__" target="a" />
+        <edge source="b" target="__END__" />
+    </graph>
+</agent>'''
+        root, count = preprocess_with_stats(raw)
+        assert root.tag == "agent"
+        assert count == count_sanitised_conditions(raw) == 1
+
+    def test_unchanged_text_reuses_parsed_root(self):
+        raw = '<agent name="cached"><state /></agent>'
+        root, count = preprocess_with_stats(raw)
+        assert preprocess_with_stats(raw) == (root, count)
+        assert preprocess_with_stats(raw.replace("cached", "other"))[0] is not root
+
+    def test_mutating_result_does_not_leak_into_next_call(self):
+        raw = '<agent name="isolated"><state /></agent>'
+        root = preprocess(raw)
+        root.set("name", "mutated")
+        root.remove(root.find("state"))
+        again = preprocess(raw)
+        assert again is not root
+        assert again.get("name") == "isolated"
+        assert again.find("state") is not None
+        assert preprocess_with_stats(raw)[0].get("name") == "isolated"
+
+    def test_source_without_escapable_blocks_is_not_rebuilt(self):
+        raw = '<agent name="plain"><state /><graph><node id="a" type="llm" /></graph></agent>'
+        sanitised, count = _escape_tag_contents(raw)
+        assert sanitised is raw
+        assert count == 0